@@ -72,7 +72,7 @@ class Agent:
                 tool_call_events=[],
                 max_length=self.max_turns,
             )
-        prompt, responses = self.llm.chat_step(
+        prompt, responses = await self.llm.achat_step(
             target_name,
             sender_name,
             conv_history,
@@ -98,11 +98,11 @@ class Agent:
                 return prompt, responses
             elif is_vector_store_tool(response.tool_call_name):
                 if response.tool_call_name == "search_ground_truth":
-                    tool_results = self.gt_vector_store_tool.execute(
+                    tool_results = await self.gt_vector_store_tool.aexecute(
                         response.tool_call_args["query"]
                     )
                 else:
-                    tool_results = self.conversation_vector_store_tool.execute(
+                    tool_results = await self.conversation_vector_store_tool.aexecute(
                         response.tool_call_args["query"]
                     )
             else:
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+from src.bot.rag_module import CircuitOpenError, RagModule
+from src.utils.local_logger import LocalLogger
+
+
+class BackgroundUpdater:
+    """
+    Sends conversation store updates from a worker thread.
+
+    `update` only queues the document, so callers don't wait on embedding or
+    index maintenance. The worker sends whatever has queued up, up to
+    `max_batch_size` documents, in one batch update.
+
+    The store gives each document an id derived from its content and skips
+    ones it already has, so sending a batch again is harmless. A batch that
+    fails to send, because the connection failed, the server answered with a
+    5xx or the circuit breaker refused the call, is retried with exponential
+    backoff, up to `max_retry_delay` apart, until the server is back. A 4xx
+    answer means the batch itself was refused, so it is dropped.
+    """
+
+    def __init__(
+        self,
+        rag_module: RagModule,
+        logger: LocalLogger,
+        max_queue_size: int = 256,
+        max_batch_size: int = 16,
+        retry_backoff: float = 1.0,
+        max_retry_delay: float = 30.0,
+    ):
+        self.rag_module = rag_module
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def update(self, document: str):
+        try:
+            self.queue.put_nowait(document)
+        except queue.Full:
+            # the server is far behind; wait rather than drop conversation history
+            self.logger.warning(
+                f"Update queue is full ({self.queue.maxsize} documents), waiting"
+            )
+            self.queue.put(document)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued update has been sent or given up on, or until
+        `timeout` seconds have passed. Returns whether the queue was emptied.
+        """
+        self.logger.debug(f"Flushing {self.queue.qsize()} queued updates")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.logger.error(
+                        f"Gave up flushing after {timeout}s with "
+                        f"{self.queue.unfinished_tasks} updates unsent"
+                    )
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _collect(self) -> List[str]:
+        batch = [self.queue.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._send(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _send(self, batch: List[str]):
+        attempt = 0
+        while True:
+            try:
+                self.rag_module.update_many(batch)
+                self.logger.debug(f"Sent batch update of {len(batch)} documents")
+                return
+            except Exception as e:
+                if not self._is_transient(e):
+                    self.logger.error(
+                        f"Dropping batch update of {len(batch)} documents: {e}"
+                    )
+                    return
+                delay = min(
+                    self.retry_backoff * 2 ** min(attempt, 16), self.max_retry_delay
+                )
+                self.logger.warning(
+                    f"Batch update failed ({e}), retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def _is_transient(self, e: Exception) -> bool:
+        if isinstance(e, requests.HTTPError):
+            return e.response.status_code >= 500
+        return isinstance(e, (CircuitOpenError, requests.RequestException))
@@ -1,8 +1,11 @@
+import asyncio
 import json
+import time
 from pathlib import Path
-from typing import List
+from typing import Awaitable, Callable, Dict, List, Optional
 
 from src.bot.agent import Agent
+from src.bot.background_updater import BackgroundUpdater
 from src.bot.conv_history import ConvHistory, Message
 from src.bot.llm import LLM
 from src.bot.rag_module import RagModule
@@ -26,15 +29,33 @@ class ChatController:
         self.target_name = self.config["name"]
         self.default_user_name = self.config["default_user_name"]
         self.gt_rag_module = (
-            RagModule(self.config["gt_store_endpoint"])
+            RagModule(
+                self.config["gt_store_endpoint"], self.config.get("gt_store_name")
+            )
             if self.config["gt_store_endpoint"]
             else None
         )
         self.conversation_rag_module = (
-            RagModule(self.config["conversation_store_endpoint"])
+            RagModule(
+                self.config["conversation_store_endpoint"],
+                self.config.get("conversation_store_name"),
+            )
             if self.config["conversation_store_endpoint"]
             else None
         )
+        # conversation store writes are sent in the background so replies
+        # don't wait on embedding and index maintenance
+        self.conversation_updater = (
+            BackgroundUpdater(
+                self.conversation_rag_module,
+                self.logger,
+                self.config.get("update_queue_size", 256),
+                self.config.get("update_batch_size", 16),
+                max_retry_delay=self.config.get("update_max_retry_delay", 30.0),
+            )
+            if self.conversation_rag_module is not None
+            else None
+        )
         with open(self.config["llm_config"], "r") as f:
             self.llm_config = json.load(f)
         self.llm = LLM(
@@ -74,7 +95,7 @@ class ChatController:
                 self.config["max_conversation_length"],
                 self.config["update_index_every"],
                 (
-                    self.conversation_rag_module
+                    self.conversation_updater
                     if self.config["update_rag_index"]
                     else None
                 ),
@@ -87,20 +108,39 @@ class ChatController:
     async def make_response(
         self,
         message: Message,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> tuple[str, List[TextResponse] | List[ToolCallResponse]]:
+        """
+        Respond to a message. If `on_text` is given and tools are off, the
+        response is streamed and `on_text` is awaited with the text so far.
+        """
         if message.conversation not in self.conv_history_dict:
             raise ValueError(f"Conversation {message.conversation} not found")
         full_query = self.conv_history_dict[message.conversation].str_of_depth(
             self.config["query_context_depth"]
         )
-        if self.config["gt_store_endpoint"]:
-            gt_results = self.gt_rag_module.search(full_query)
-        else:
-            gt_results = []
-        if self.config["conversation_store_endpoint"]:
-            conversation_results = self.conversation_rag_module.search(full_query)
-        else:
-            conversation_results = []
+        timings = {}
+        start = time.perf_counter()
+        # the stores are searched concurrently, so retrieval takes as long as
+        # the slower of the two
+        gt_results, conversation_results = await asyncio.gather(
+            self._search_store(
+                "gt",
+                self.gt_rag_module,
+                full_query,
+                self.config.get("gt_store_timeout", 5.0),
+                timings,
+            ),
+            self._search_store(
+                "conversation",
+                self.conversation_rag_module,
+                full_query,
+                self.config.get("conversation_store_timeout", 5.0),
+                timings,
+            ),
+        )
+        timings["retrieval"] = time.perf_counter() - start
+        start = time.perf_counter()
         if self.tool_use:
             prompt, responses = await self.agent.invoke_agent(
                 self.target_name,
@@ -111,8 +151,24 @@ class ChatController:
                 self.config["include_timestamp"],
                 message.conversation,
             )
+        elif on_text is not None:
+
+            async def on_text_timed(text: str):
+                timings.setdefault("first_token", time.perf_counter() - start)
+                await on_text(text)
+
+            prompt, responses = await self.llm.astream_chat_step(
+                self.target_name,
+                message.sender_name,
+                self.conv_history_dict[message.conversation],
+                gt_results,
+                conversation_results,
+                self.config["include_timestamp"],
+                message.conversation,
+                on_text_timed,
+            )
         else:
-            prompt, responses = self.llm.chat_step(
+            prompt, responses = await self.llm.achat_step(
                 self.target_name,
                 message.sender_name,
                 self.conv_history_dict[message.conversation],
@@ -121,10 +177,53 @@ class ChatController:
                 self.config["include_timestamp"],
                 message.conversation,
             )
+        timings["generation"] = time.perf_counter() - start
+        self.logger.info(
+            "Response timings: "
+            + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items())
+        )
         return prompt, responses
 
+    async def _search_store(
+        self,
+        store: str,
+        rag_module: Optional[RagModule],
+        query: str,
+        timeout: float,
+        timings: Dict[str, float],
+    ) -> List[str]:
+        """Search a store, returning no results if it fails or is too slow."""
+        if rag_module is None:
+            return []
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(rag_module.asearch(query), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Search of the {store} store timed out after {timeout}s, "
+                "responding without its results"
+            )
+        except Exception as e:
+            self.logger.warning(
+                f"Search of the {store} store failed, responding without its "
+                f"results: {e}"
+            )
+        finally:
+            timings[f"{store}_search"] = time.perf_counter() - start
+        return []
+
     def emergency_save(self):
         for conversation_name in self.conv_history_dict:
             if self.conversation_rag_module is not None:
                 self.logger.info("Saving conversations to rag module")
                 self.conv_history_dict[conversation_name].emergency_save()
+        if self.conversation_updater is not None:
+            self.conversation_updater.flush(
+                self.config.get("update_flush_timeout", 60.0)
+            )
+
+    async def aclose(self):
+        """Close the connections to the retrieval servers."""
+        for rag_module in (self.gt_rag_module, self.conversation_rag_module):
+            if rag_module is not None:
+                await rag_module.aclose()
@@ -1,5 +1,5 @@
+from src.bot.background_updater import BackgroundUpdater
 from src.bot.message import Message
-from src.bot.rag_module import RagModule
 from src.utils.local_logger import LocalLogger
 
 
@@ -15,7 +15,7 @@ class ConvHistory:
         include_timestamp: bool,
         max_char_length: int,
         update_chunk_length: int,
-        rag_module: RagModule,
+        rag_module: BackgroundUpdater,
         logger: LocalLogger,
         qa_mode: bool,
         conv_title: str,
@@ -29,19 +29,35 @@ class ConvHistory:
         self.rag_module = rag_module
         self.qa_mode = qa_mode
         self.conv_title = conv_title
+        # each message is rendered once when added, and the rendered history
+        # is kept up to date as messages are added and trimmed
+        self.rendered_messages = []
+        self.rendered_history = ""
 
     def add(self, message: Message):
         self.logger.debug(f"Adding message to history: {message}")
         self.history.append(message)
+        rendered_message = message.rag_string(include_timestamp=self.include_timestamp)
+        self.rendered_messages.append(rendered_message)
+        if len(self.rendered_messages) == 1:
+            self.rendered_history = rendered_message
+        else:
+            self.rendered_history += "\n" + rendered_message
         self.trim_history()
 
     def trim_history(self):
         if self.qa_mode:
             # only keep most recent message
             self.history = self.history[-1:]
+            self.rendered_messages = self.rendered_messages[-1:]
+            self.rendered_history = "".join(self.rendered_messages)
         else:
-            while len(str(self)) > self.max_char_length:
+            while len(self.rendered_history) > self.max_char_length:
                 removed_msg = self.history.pop(0)
+                removed_rendered = self.rendered_messages.pop(0)
+                self.rendered_history = self.rendered_history[
+                    len(removed_rendered) + 1 :
+                ]
                 self.removed_buffer.append(removed_msg)
                 # When buffer reaches chunk size, trigger update
                 if len(self.removed_buffer) >= self.update_chunk_length:
@@ -87,13 +103,18 @@ class ConvHistory:
 
     def clear(self):
         self.history = []
+        self.rendered_messages = []
+        self.rendered_history = ""
 
     def str_of_depth(self, depth: int) -> str:
-        return "\n".join(
-            [
-                message.rag_string(include_timestamp=self.include_timestamp)
-                for message in self.history[-depth:]
-            ]
+        if depth == 0 or depth >= len(self.rendered_messages):
+            return self.rendered_history
+        return "\n".join(self.rendered_messages[-depth:])
+
+    def participant_names(self) -> list[str]:
+        """Names of everyone with a message in the history, most recent first."""
+        return list(
+            dict.fromkeys(message.sender_name for message in reversed(self.history))
         )
 
     def get_image_attachments(self) -> list[str]:
@@ -106,4 +127,4 @@ class ConvHistory:
         return attachments
 
     def __str__(self) -> str:
-        return self.str_of_depth(len(self.history))
+        return self.rendered_history
@@ -1,18 +1,70 @@
+import re
+import threading
 from datetime import datetime as dt
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from jinja2 import Template
+import pydantic
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
 
 from src.bot.tools.types import ToolCallHistory
 
+# blocks a template defines to be rendered as separately cacheable segments
+SEGMENT_BLOCKS = ("system", "history", "context")
+
+# one environment per template directory, shared by every formatter so each
+# template is compiled once per process, with compiled bytecode cached on
+# disk for the next process
+_environments: Dict[Path, Environment] = {}
+_bytecode_cache: Optional[FileSystemBytecodeCache] = None
+_environments_lock = threading.Lock()
+
+
+def load_template(template_path: Path) -> Template:
+    """Load a prompt template, compiling it only if it isn't already loaded."""
+    global _bytecode_cache
+    template_path = Path(template_path).resolve()
+    with _environments_lock:
+        environment = _environments.get(template_path.parent)
+        if environment is None:
+            if _bytecode_cache is None:
+                _bytecode_cache = FileSystemBytecodeCache()
+            environment = Environment(
+                loader=FileSystemLoader(template_path.parent),
+                bytecode_cache=_bytecode_cache,
+            )
+            _environments[template_path.parent] = environment
+    # templates that changed on disk are recompiled
+    return environment.get_template(template_path.name)
+
+
+class PromptSegments(pydantic.BaseModel):
+    """
+    A prompt split by how often its parts change, so providers can cache the
+    stable prefix: `system` is the same on every call, `history` only grows
+    until the conversation is trimmed, and `context` changes every call.
+    `history_blocks` splits `history` at message boundaries, and
+    `history_tail` is whatever the template puts after the last message, so a
+    cached prefix ending at an earlier message still matches once more are
+    added.
+    """
+
+    system: str
+    history: str
+    history_blocks: List[str]
+    history_tail: str
+    context: str
+
+    def __str__(self):
+        return self.system + self.history + self.context
+
 
 class ConversationPromptFormatter:
 
     def __init__(self, template_path: Path) -> None:
-        self.template = Template(template_path.read_text())
+        self.template = load_template(template_path)
 
-    def make_query(
+    def _template_context(
         self,
         name: str,
         chat_user_name: str,
@@ -22,8 +74,8 @@ class ConversationPromptFormatter:
         include_timestamp: bool,
         current_conversation_name: str,
         tool_call_history: ToolCallHistory,
-    ) -> str:
-        context = {
+    ) -> dict:
+        return {
             "name": name,
             "gt_results": gt_results,
             "conversation_results": conversation_results,
@@ -35,45 +87,223 @@ class ConversationPromptFormatter:
             "current_conversation_name": current_conversation_name,
             "tool_call_history": tool_call_history,
         }
+
+    def make_query(
+        self,
+        name: str,
+        chat_user_name: str,
+        conv_history: str,
+        gt_results: List[str],
+        conversation_results: List[str],
+        include_timestamp: bool,
+        current_conversation_name: str,
+        tool_call_history: ToolCallHistory,
+    ) -> str:
+        context = self._template_context(
+            name,
+            chat_user_name,
+            conv_history,
+            gt_results,
+            conversation_results,
+            include_timestamp,
+            current_conversation_name,
+            tool_call_history,
+        )
         return self.template.render(**context)
 
-    def trim_chat_after_other_user(self, chat_log: str, target_name: str) -> str:
+    def supports_segments(self) -> bool:
+        return all(block in self.template.blocks for block in SEGMENT_BLOCKS)
+
+    def make_segments(
+        self,
+        name: str,
+        chat_user_name: str,
+        conv_history: str,
+        gt_results: List[str],
+        conversation_results: List[str],
+        include_timestamp: bool,
+        current_conversation_name: str,
+        tool_call_history: ToolCallHistory,
+    ) -> PromptSegments:
+        """Renders each of the template's segment blocks separately."""
+        template_context = self.template.new_context(
+            self._template_context(
+                name,
+                chat_user_name,
+                conv_history,
+                gt_results,
+                conversation_results,
+                include_timestamp,
+                current_conversation_name,
+                tool_call_history,
+            )
+        )
+        rendered = {
+            block: "".join(self.template.blocks[block](template_context))
+            for block in SEGMENT_BLOCKS
+        }
+        history_blocks, history_tail = self.split_history(
+            rendered["history"], conv_history
+        )
+        return PromptSegments(
+            **rendered, history_blocks=history_blocks, history_tail=history_tail
+        )
+
+    def split_history(self, history: str, conv_history) -> Tuple[List[str], str]:
+        """
+        Split a rendered history segment into one block per message.
+
+        Args:
+            history (str): The rendered history segment
+            conv_history: The conversation history it was rendered from, a
+                ConvHistory or a string
+
+        Returns:
+            Tuple[List[str], str]: Blocks that each end with a message, and
+            the text after the last message, which together make up
+            `history`; `[history]` and no tail if the messages can't be
+            found in it
+        """
+        messages = getattr(conv_history, "rendered_messages", None)
+        rendered_history = str(conv_history)
+        start = history.find(rendered_history) if messages else -1
+        if start == -1:
+            return ([history] if history else []), ""
+        blocks = [history[:start] + messages[0]]
+        blocks.extend("\n" + message for message in messages[1:])
+        return blocks, history[start + len(rendered_history) :]
+
+    def line_speaker(
+        self, line: str, known_names: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """
+        Returns the speaker of a chat line with format "{optional [timestamp]} {user}: {message}".
+
+        Args:
+            line (str): A line of a chat log
+            known_names (Optional[List[str]]): Names of the conversation's
+                participants, which may contain spaces
+
+        Returns:
+            Optional[str]: The known name the line starts with, or else the
+            word the line starts with if a colon and a space follow it, or None
+        """
+        line = line.strip()
+        if line.startswith("["):
+            # skip the timestamp, which has colons of its own
+            if "]" not in line:
+                return None
+            line = line[line.index("]") + 1 :].strip()
+        for name in known_names or []:
+            if line.startswith(f"{name}:"):
+                return name
+        # any other colon, as in "see https://..." or "note to self: ...",
+        # is part of the message
+        match = re.match(r"(\S+):(\s|$)", line)
+        return match.group(1) if match else None
+
+    def other_user_turn_start(
+        self,
+        chat_log: str,
+        target_name: str,
+        other_names: Optional[List[str]] = None,
+    ) -> Optional[int]:
+        """
+        Finds where a message not authored by the target user starts in a chat log.
+
+        The first line continues the target's message from the prompt, and
+        lines without a speaker continue the message before them.
+
+        Args:
+            chat_log (str): Chat log text continuing one of the target's messages
+            target_name (str): The name of the target user
+            other_names (Optional[List[str]]): Names of the other participants
+
+        Returns:
+            Optional[int]: Offset of the first line spoken by another user, or None
+        """
+        known_names = [target_name] + (other_names or [])
+        line_start = chat_log.find("\n")
+        while line_start != -1:
+            line_start += 1
+            line_end = chat_log.find("\n", line_start)
+            line = (
+                chat_log[line_start:]
+                if line_end == -1
+                else chat_log[line_start:line_end]
+            )
+            speaker = self.line_speaker(line, known_names)
+            if speaker is not None and speaker != target_name:
+                return line_start
+            line_start = line_end
+        return None
+
+    def stream_cutoff(
+        self,
+        chat_log: str,
+        target_name: str,
+        other_names: Optional[List[str]] = None,
+    ) -> Tuple[int, bool]:
+        """
+        Checks a partial chat log as it is generated.
+
+        Args:
+            chat_log (str): Chat log text generated so far
+            target_name (str): The name of the target user
+            other_names (Optional[List[str]]): Names of the other participants
+
+        Returns:
+            Tuple[int, bool]: The length of the prefix that is known to be the
+            target's, and whether another user's message has started, in
+            which case the rest of the generation is wasted
+        """
+        turn_start = self.other_user_turn_start(chat_log, target_name, other_names)
+        if turn_start is not None:
+            return turn_start, True
+        last_line_start = chat_log.rfind("\n") + 1
+        # a partial line could still turn out to start with another user's name
+        if (
+            last_line_start > 0
+            and self.line_speaker(
+                chat_log[last_line_start:], [target_name] + (other_names or [])
+            )
+            is None
+        ):
+            return last_line_start, False
+        return len(chat_log), False
+
+    def trim_chat_after_other_user(
+        self,
+        chat_log: str,
+        target_name: str,
+        other_names: Optional[List[str]] = None,
+    ) -> str:
         """
         Trims a chat log after the first message not authored by the target user.
 
         Args:
             chat_log (str): The chat log text with format "{optional timestamp}{user}: {message}"
             target_name (str): The name of the target user whose messages we want to keep
+            other_names (Optional[List[str]]): Names of the other participants
 
         Returns:
             str: The trimmed chat log
         """
-        lines = chat_log.split("\n")
-        result = []
-
-        for line in lines:
-            # Skip empty lines
-            if not line.strip():
-                continue
-
-            # Find where the username ends and the message begins
-            colon_pos = line.find(":")
-            if colon_pos == -1:
-                result.append(line.strip())
-
-            # Extract the username, handling optional timestamps
-            username_part = line[:colon_pos].strip()
-            # The username is the last word before the colon
-            username = username_part.split()[-1] if username_part.split() else ""
-
-            # Add the line to the result if it's from the target user
-            if username == target_name:
-                result.append(line)
-            else:
-                # Stop processing once we hit a message from another user
-                break
+        turn_start = self.other_user_turn_start(chat_log, target_name, other_names)
+        if turn_start is not None:
+            chat_log = chat_log[:turn_start]
+        lines = [line for line in chat_log.split("\n") if line.strip()]
+        # generation stopped by a stop sequence can leave the timestamp of
+        # another user's message behind
+        if len(lines) > 1 and self.is_timestamp_only(lines[-1]):
+            lines.pop()
+        return "\n".join(lines)
 
-        return "\n".join(result)
+    def is_timestamp_only(self, line: str) -> bool:
+        line = line.strip()
+        return line.startswith("[") and (
+            "]" not in line or not line[line.index("]") + 1 :].strip()
+        )
 
     def trim_after_repetition(self, messages: List[str]) -> List[str]:
         """
@@ -99,8 +329,15 @@ class ConversationPromptFormatter:
 
         return result
 
-    def cleanup_output(self, output: str, target_name: str) -> list[str]:
-        output_trimmed = self.trim_chat_after_other_user(output, target_name)
+    def cleanup_output(
+        self,
+        output: str,
+        target_name: str,
+        other_names: Optional[List[str]] = None,
+    ) -> list[str]:
+        output_trimmed = self.trim_chat_after_other_user(
+            output, target_name, other_names
+        )
         # sometimes output is multiple messages, split by newlines with the prefix target_name
         output_trimmed = output_trimmed.split(f"{target_name}:")
         output_trimmed = self.trim_after_repetition(output_trimmed)
@@ -1,5 +1,7 @@
 import asyncio
 import json
+import secrets
+import time
 from pathlib import Path
 from typing import Optional
 
@@ -43,6 +45,50 @@ def get_chat_name(message: discord.Message) -> str:
     return chat_name
 
 
+DISCORD_MAX_MESSAGE_LENGTH = 2000
+
+
+class StreamedMessage:
+    """
+    A response posted as soon as it starts and edited as it is generated.
+
+    Edits are throttled to one per `edit_interval` seconds to stay within
+    Discord's rate limits.
+    """
+
+    def __init__(self, channel: discord.abc.Messageable, edit_interval: float):
+        self.channel = channel
+        self.edit_interval = edit_interval
+        # lets on_message recognize the message before send returns
+        self.nonce = secrets.token_hex(8)
+        self.message: Optional[discord.Message] = None
+        self.text = ""
+        self.last_edit = 0.0
+
+    async def show(self, text: str):
+        text = text.strip()[:DISCORD_MAX_MESSAGE_LENGTH]
+        if not text:
+            return
+        self.text = text
+        now = time.monotonic()
+        if self.message is None:
+            self.message = await self.channel.send(text, nonce=self.nonce)
+            self.last_edit = now
+        elif now - self.last_edit >= self.edit_interval:
+            self.message = await self.message.edit(content=text)
+            self.last_edit = now
+
+    async def finish(self, text: Optional[str]) -> Optional[discord.Message]:
+        """Edit in the final text, or the latest partial text if there is none."""
+        if self.message is None:
+            return None
+        if text is not None and text.strip():
+            self.text = text.strip()[:DISCORD_MAX_MESSAGE_LENGTH]
+        if self.message.content != self.text:
+            self.message = await self.message.edit(content=self.text)
+        return self.message
+
+
 class DiscordBot(discord.Client):
     def __init__(
         self,
@@ -64,6 +110,7 @@ class DiscordBot(discord.Client):
             else None
         )
         self.response_tasks = {}  # conversation_id -> asyncio.Task
+        self.streaming_nonces = set()
 
     async def on_ready(self):
         await self.chat_controller.initialize_tools()
@@ -136,6 +183,9 @@ class DiscordBot(discord.Client):
                 message.author == self.user
                 and not message.content == conv_clear_message
             ):
+                if message.nonce in self.streaming_nonces:
+                    # added to the history once the response is complete
+                    return
                 self_message = await self.message_from_discord_message(message)
                 self.chat_controller.update_conv_history(self_message)
                 return
@@ -222,16 +272,33 @@ class DiscordBot(discord.Client):
                 )
                 await message.channel.send(conv_clear_message)
             else:
-                prompt, responses = await self.chat_controller.make_response(
-                    user_message
-                )
-                self.logger.debug(f"Prompt: {prompt}")
-                self.logger.debug(f"Responses: {responses}")
-                if isinstance(responses[0], TextResponse):
+                stream = None
+                if self.discord_config.get("stream_responses", False):
+                    stream = StreamedMessage(
+                        message.channel,
+                        self.discord_config.get("stream_edit_interval", 1.0),
+                    )
+                    self.streaming_nonces.add(stream.nonce)
+                final_text = None
+                try:
+                    prompt, responses = await self.chat_controller.make_response(
+                        user_message, stream.show if stream else None
+                    )
+                    self.logger.debug(f"Prompt: {prompt}")
+                    self.logger.debug(f"Responses: {responses}")
+                    if stream is not None and stream.message is not None:
+                        final_text = responses[0].text
+                        responses = responses[1:]
+                finally:
+                    if stream is not None:
+                        # if the response failed or was cancelled, this keeps
+                        # the partial response that was already posted
+                        await self.finish_streamed_message(stream, final_text)
+                if responses and isinstance(responses[0], TextResponse):
                     for response in responses:
                         await message.channel.send(response.text)
                         await asyncio.sleep(0.5)
-                elif isinstance(responses[0], ToolCallResponse):
+                elif responses and isinstance(responses[0], ToolCallResponse):
                     for response in responses:
                         await self.communication_tool_call(
                             message, user_message, response
@@ -243,6 +310,18 @@ class DiscordBot(discord.Client):
             self.logger.error(f"Error in handle_response: {e}")
             raise e
 
+    async def finish_streamed_message(
+        self, stream: StreamedMessage, text: Optional[str]
+    ):
+        try:
+            final_message = await stream.finish(text)
+        finally:
+            self.streaming_nonces.discard(stream.nonce)
+        if final_message is not None:
+            self.chat_controller.update_conv_history(
+                await self.message_from_discord_message(final_message)
+            )
+
     async def handle_reaction(self, payload):
         try:
             removed = payload.event_type == "REACTION_REMOVE"
@@ -1,14 +1,25 @@
+import asyncio
 import json
+from contextlib import aclosing
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
 
+import httpx
 import requests
 
 from src.bot.conv_history import ConvHistory
-from src.bot.conversation_prompt_formatter import ConversationPromptFormatter
+from src.bot.conversation_prompt_formatter import (
+    ConversationPromptFormatter,
+    PromptSegments,
+)
 from src.bot.tools.types import TextResponse, Tool, ToolCallHistory, ToolCallResponse
 from src.utils.local_logger import LocalLogger
 
+# the most stop sequences the OpenAI completions API accepts
+MAX_STOP_SEQUENCES = 4
+# marks the end of a prefix for Anthropic to cache
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+
 
 class LLM:
     def __init__(
@@ -26,12 +37,31 @@ class LLM:
         self.prompt_params = self.config["prompt_params"]
         self.model = self.config["model"]
         self.vision = self.config["vision"]
+        # split the prompt so providers can cache its stable prefix
+        self.prompt_caching = self.config.get("prompt_caching", False)
+        self.token_usage = {"prompt_tokens": 0, "cached_tokens": 0}
+        self.timeout = self.config.get("timeout", 120.0)
+        self.max_connections = self.config.get("max_connections", 16)
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
         if prompt_template_path:
             self.conversation_formatter = ConversationPromptFormatter(
                 Path(prompt_template_path)
             )
         else:
             self.conversation_formatter = None
+        if self.prompt_caching and not (
+            self.instruct
+            and self.conversation_formatter is not None
+            and self.conversation_formatter.supports_segments()
+        ):
+            # completion prompts are a single string, so providers that cache
+            # them do so without help
+            self.logger.warning(
+                "prompt_caching needs an instruct model and a template with "
+                "system, history and context blocks; sending whole prompts"
+            )
+            self.prompt_caching = False
 
     def chat_step(
         self,
@@ -45,7 +75,7 @@ class LLM:
         tools: Optional[List[Tool]] = None,
         tool_call_history: Optional[ToolCallHistory] = None,
     ) -> Tuple[str, List[TextResponse] | List[ToolCallResponse]]:
-        prompt = self.conversation_formatter.make_query(
+        prompt, segments = self.make_prompt(
             name,
             chat_user_name,
             conv_history,
@@ -58,25 +88,278 @@ class LLM:
         if self.instruct:
             image_attachments = conv_history.get_image_attachments()
             instruct_output = self.make_instruct_request(
-                prompt, tools, image_attachments
+                prompt, tools, image_attachments, segments
             )
             if isinstance(instruct_output, TextResponse):
                 responses = [instruct_output]
             else:
                 responses = instruct_output
         else:
-            responses = self.make_completion_request(prompt, name, chat_user_name)
+            responses = self.make_completion_request(
+                prompt,
+                name,
+                chat_user_name,
+                self.other_names(conv_history, name, chat_user_name),
+                include_timestamp,
+            )
         return prompt, responses
 
-    def make_instruct_request(
-        self, prompt: str, tools: list[str], image_attachments: list[str]
-    ) -> TextResponse | List[ToolCallResponse]:
+    async def achat_step(
+        self,
+        name: str,
+        chat_user_name: str,
+        conv_history: ConvHistory,
+        gt_results: List[str],
+        conversation_results: List[str],
+        include_timestamp: bool,
+        current_conversation_name: str,
+        tools: Optional[List[Tool]] = None,
+        tool_call_history: Optional[ToolCallHistory] = None,
+    ) -> Tuple[str, List[TextResponse] | List[ToolCallResponse]]:
         """
-        Make an instruct request to the LLM.
-        If tools are provided, the response will be a list of ToolCallResponse.
-        Otherwise, the response will be a TextResponse.
+        Async version of `chat_step`. Cancelling it aborts the request to the
+        LLM endpoint.
         """
-        self.logger.debug(f"Making instruct request with prompt: {prompt}")
+        prompt, segments = self.make_prompt(
+            name,
+            chat_user_name,
+            conv_history,
+            gt_results,
+            conversation_results,
+            include_timestamp,
+            current_conversation_name,
+            tool_call_history,
+        )
+        if self.instruct:
+            image_attachments = conv_history.get_image_attachments()
+            instruct_output = await self.amake_instruct_request(
+                prompt, tools, image_attachments, segments
+            )
+            if isinstance(instruct_output, TextResponse):
+                responses = [instruct_output]
+            else:
+                responses = instruct_output
+        else:
+            responses = await self.amake_completion_request(
+                prompt,
+                name,
+                chat_user_name,
+                self.other_names(conv_history, name, chat_user_name),
+                include_timestamp,
+            )
+        return prompt, responses
+
+    async def astream_chat_step(
+        self,
+        name: str,
+        chat_user_name: str,
+        conv_history: ConvHistory,
+        gt_results: List[str],
+        conversation_results: List[str],
+        include_timestamp: bool,
+        current_conversation_name: str,
+        on_text: Callable[[str], Awaitable[None]],
+    ) -> Tuple[str, List[TextResponse]]:
+        """
+        Version of `achat_step` that streams the response, without tools.
+
+        `on_text` is awaited with the response text generated so far each
+        time more arrives. For completion models, generation stops as soon as
+        the model starts writing another user's message.
+        """
+        prompt, segments = self.make_prompt(
+            name,
+            chat_user_name,
+            conv_history,
+            gt_results,
+            conversation_results,
+            include_timestamp,
+            current_conversation_name,
+            None,
+        )
+        if self.instruct:
+            headers, request_body, is_messages_endpoint = self._instruct_request(
+                prompt, None, conv_history.get_image_attachments(), segments
+            )
+        else:
+            other_names = self.other_names(conv_history, name, chat_user_name)
+            headers, request_body = self._completion_request(
+                prompt, other_names, include_timestamp
+            )
+            is_messages_endpoint = False
+        self.logger.debug(f"Making streaming request with prompt: {prompt}")
+        text = ""
+        shown = 0
+        async with aclosing(
+            self._astream_deltas(headers, request_body, is_messages_endpoint)
+        ) as deltas:
+            async for delta in deltas:
+                text += delta
+                if self.instruct:
+                    await on_text(text)
+                    continue
+                cutoff, other_user_started = self.conversation_formatter.stream_cutoff(
+                    text, name, other_names
+                )
+                if cutoff > shown:
+                    shown = cutoff
+                    await on_text(text[:cutoff])
+                if other_user_started:
+                    # leaving the stream closes the connection, which stops generation
+                    self.logger.debug("Stopping generation at another user's message")
+                    text = text[:cutoff]
+                    break
+        # the last line was held back in case it started another user's
+        # message; once the stream has ended it is the target's, unless it is
+        # the timestamp of a message a stop sequence cut off
+        if (
+            not self.instruct
+            and len(text) > shown
+            and not self.conversation_formatter.is_timestamp_only(text[shown:])
+        ):
+            await on_text(text)
+        self.logger.debug(f"LLM streamed response: {text}")
+        if self.instruct:
+            return prompt, [TextResponse(text=text)]
+        cleaned_response = self.conversation_formatter.cleanup_output(
+            text, name, other_names
+        )
+        return prompt, [TextResponse(text=response) for response in cleaned_response]
+
+    async def _astream_deltas(
+        self, headers: dict, request_body: dict, is_messages_endpoint: bool
+    ) -> AsyncIterator[str]:
+        """Make a streaming request and yield text as server-sent events arrive."""
+        request_body = {**request_body, "stream": True}
+        if self.prompt_caching and not is_messages_endpoint:
+            # OpenAI only reports usage of streamed responses when asked to
+            request_body["stream_options"] = {"include_usage": True}
+        async with self._get_async_client().stream(
+            "POST",
+            self.api_base,
+            headers=headers,
+            json=request_body,
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if is_messages_endpoint:
+                    if event["type"] == "error":
+                        raise Exception(f"LLM stream error: {event['error']}")
+                    if event["type"] == "message_stop":
+                        break
+                    if event["type"] == "message_start":
+                        self.report_usage(event["message"].get("usage"), True)
+                    if (
+                        event["type"] == "content_block_delta"
+                        and event["delta"]["type"] == "text_delta"
+                    ):
+                        yield event["delta"]["text"]
+                    continue
+                if event.get("usage"):
+                    self.report_usage(event["usage"], False)
+                if event.get("choices"):
+                    choice = event["choices"][0]
+                    # chat completions stream deltas, completions stream text
+                    delta = (
+                        choice["delta"].get("content")
+                        if self.instruct
+                        else choice.get("text")
+                    )
+                    if delta:
+                        yield delta
+
+    def make_prompt(
+        self,
+        name: str,
+        chat_user_name: str,
+        conv_history: ConvHistory,
+        gt_results: List[str],
+        conversation_results: List[str],
+        include_timestamp: bool,
+        current_conversation_name: str,
+        tool_call_history: Optional[ToolCallHistory],
+    ) -> Tuple[str, Optional[PromptSegments]]:
+        """
+        Render the prompt, split into cacheable segments when prompt caching
+        is on for an instruct model and the template defines them.
+        """
+        args = (
+            name,
+            chat_user_name,
+            conv_history,
+            gt_results,
+            conversation_results,
+            include_timestamp,
+            current_conversation_name,
+            tool_call_history,
+        )
+        if self.prompt_caching:
+            segments = self.conversation_formatter.make_segments(*args)
+            return str(segments), segments
+        return self.conversation_formatter.make_query(*args), None
+
+    def report_usage(self, usage: Optional[dict], is_messages_endpoint: bool):
+        """Log the prompt tokens of a response and how many were read from cache."""
+        if not usage:
+            return
+        if is_messages_endpoint:
+            # Anthropic counts cached tokens separately from input_tokens
+            cached_tokens = usage.get("cache_read_input_tokens") or 0
+            cache_writes = usage.get("cache_creation_input_tokens") or 0
+            prompt_tokens = usage.get("input_tokens", 0) + cached_tokens + cache_writes
+        else:
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get(
+                "cached_tokens"
+            ) or 0
+            cache_writes = 0
+            prompt_tokens = usage.get("prompt_tokens", 0)
+        self.token_usage["prompt_tokens"] += prompt_tokens
+        self.token_usage["cached_tokens"] += cached_tokens
+        message = f"Prompt tokens: {prompt_tokens}, {cached_tokens} read from cache"
+        if cache_writes:
+            message += f", {cache_writes} written to cache"
+        if self.token_usage["prompt_tokens"]:
+            cached_share = (
+                self.token_usage["cached_tokens"] / self.token_usage["prompt_tokens"]
+            )
+            message += f" ({cached_share:.0%} cached overall)"
+        self.logger.info(message)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # one pooled client shared by every conversation, tied to the event
+        # loop it was made in
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout,
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    def _instruct_request(
+        self,
+        prompt: str,
+        tools: list[str],
+        image_attachments: list[str],
+        segments: Optional[PromptSegments] = None,
+    ) -> Tuple[dict, dict, bool]:
+        """
+        Build the headers and body of an instruct request, and whether it
+        goes to a messages endpoint.
+        """
+        is_messages_endpoint = "messages" in self.api_base
         is_anthropic = "claude" in self.model.lower() or "anthropic" in self.api_base
 
         headers = {"content-type": "application/json"}
@@ -99,12 +382,33 @@ class LLM:
                     {"type": "image_url", "image_url": {"url": attachment + ".png"}}
                     for attachment in image_attachments
                 ]
-            content = [
-                {"type": "text", "text": prompt},
+        else:
+            image_attachments = []
+
+        if segments is None:
+            text_blocks = [{"type": "text", "text": prompt}]
+        else:
+            # the system segment goes in its own message, ahead of the rest
+            text_blocks = [
+                {"type": "text", "text": block} for block in segments.history_blocks
             ]
-            content.extend(image_attachments)
+            if is_messages_endpoint and text_blocks:
+                # cache everything up to the end of the history. The next
+                # call's history extends this one's by a message or a few, and
+                # Anthropic looks back up to 20 blocks from a breakpoint for a
+                # cached prefix, so it reads the prefix this call writes
+                text_blocks[-1]["cache_control"] = EPHEMERAL_CACHE_CONTROL
+            if segments.history_tail or segments.context:
+                text_blocks.append(
+                    {
+                        "type": "text",
+                        "text": segments.history_tail + segments.context,
+                    }
+                )
+        if self.vision or (segments is not None and is_messages_endpoint):
+            content = text_blocks + image_attachments
         else:
-            content = prompt
+            content = "".join(block["text"] for block in text_blocks)
 
         request_body = {
             "model": self.model,
@@ -113,7 +417,21 @@ class LLM:
             ],
             **self.prompt_params,
         }
-        is_messages_endpoint = "messages" in self.api_base
+        if segments is not None and segments.system:
+            # providers match cached prefixes from the start of the request,
+            # and OpenAI caches long enough prefixes automatically
+            if is_messages_endpoint:
+                request_body["system"] = [
+                    {
+                        "type": "text",
+                        "text": segments.system,
+                        "cache_control": EPHEMERAL_CACHE_CONTROL,
+                    }
+                ]
+            else:
+                request_body["messages"].insert(
+                    0, {"role": "system", "content": segments.system}
+                )
 
         if tools:
             if is_messages_endpoint:
@@ -130,17 +448,17 @@ class LLM:
             request_body["tools"] = formatted_tool_dicts
             request_body["tool_choice"] = tool_choice
 
-        response = requests.post(
-            self.api_base,
-            headers=headers,
-            json=request_body,
-        )
-        response.raise_for_status()
-        self.logger.debug(f"LLM response: {response.json()}")
+        return headers, request_body, is_messages_endpoint
+
+    def _parse_instruct_response(
+        self, response_json: dict, tools: list[str], is_messages_endpoint: bool
+    ) -> TextResponse | List[ToolCallResponse]:
+        self.logger.debug(f"LLM response: {response_json}")
+        self.report_usage(response_json.get("usage"), is_messages_endpoint)
 
         try:
             if is_messages_endpoint:
-                content = response.json()["content"][0]
+                content = response_json["content"][0]
                 if tools:
                     results = [
                         ToolCallResponse(
@@ -153,7 +471,7 @@ class LLM:
                     results = TextResponse(text=content["text"])
             else:
                 if tools:
-                    raw_results = response.json()["choices"][0]["message"]["tool_calls"]
+                    raw_results = response_json["choices"][0]["message"]["tool_calls"]
                     results = [
                         ToolCallResponse(
                             tool_call_id=result["id"],
@@ -163,7 +481,7 @@ class LLM:
                         for result in raw_results
                     ]
                 else:
-                    raw_results = response.json()["choices"][0]["message"]["content"]
+                    raw_results = response_json["choices"][0]["message"]["content"]
                     results = TextResponse(text=raw_results)
 
         except Exception as e:
@@ -171,20 +489,135 @@ class LLM:
 
         return results
 
-    def make_completion_request(
-        self, prompt: str, name: str, chat_user_name: str
-    ) -> str:
-        self.logger.debug(f"Making completion request with prompt: {prompt}")
-        # use completion api: https://platform.openai.com/docs/api-reference/completions
+    def make_instruct_request(
+        self,
+        prompt: str,
+        tools: list[str],
+        image_attachments: list[str],
+        segments: Optional[PromptSegments] = None,
+    ) -> TextResponse | List[ToolCallResponse]:
+        """
+        Make an instruct request to the LLM.
+        If tools are provided, the response will be a list of ToolCallResponse.
+        Otherwise, the response will be a TextResponse.
+        """
+        self.logger.debug(f"Making instruct request with prompt: {prompt}")
+        headers, request_body, is_messages_endpoint = self._instruct_request(
+            prompt, tools, image_attachments, segments
+        )
         response = requests.post(
             self.api_base,
-            headers={"Authorization": f"Bearer {self.api_key}"},
-            json={"model": self.model, "prompt": prompt, **self.prompt_params},
+            headers=headers,
+            json=request_body,
+            timeout=self.timeout,
         )
         response.raise_for_status()
-        self.logger.debug(f"LLM response: {response.json()}")
-        raw_response = response.json()["choices"][0]["text"]
+        return self._parse_instruct_response(
+            response.json(), tools, is_messages_endpoint
+        )
+
+    async def amake_instruct_request(
+        self,
+        prompt: str,
+        tools: list[str],
+        image_attachments: list[str],
+        segments: Optional[PromptSegments] = None,
+    ) -> TextResponse | List[ToolCallResponse]:
+        """Async version of `make_instruct_request`."""
+        self.logger.debug(f"Making instruct request with prompt: {prompt}")
+        headers, request_body, is_messages_endpoint = self._instruct_request(
+            prompt, tools, image_attachments, segments
+        )
+        response = await self._get_async_client().post(
+            self.api_base,
+            headers=headers,
+            json=request_body,
+        )
+        response.raise_for_status()
+        return self._parse_instruct_response(
+            response.json(), tools, is_messages_endpoint
+        )
+
+    def other_names(
+        self, conv_history: ConvHistory, name: str, chat_user_name: str
+    ) -> List[str]:
+        """Names of the other participants in a conversation, most recent first."""
+        names = [chat_user_name] + conv_history.participant_names()
+        return list(dict.fromkeys(n for n in names if n and n != name))
+
+    def stop_sequences(
+        self, other_names: List[str], include_timestamp: bool
+    ) -> List[str]:
+        """
+        Stop sequences that end a completion when the model starts writing
+        another participant's message.
+        """
+        stop = self.prompt_params.get("stop") or []
+        if isinstance(stop, str):
+            stop = [stop]
+        # lines start with "[timestamp] name:" or "name:"
+        prefix = "] " if include_timestamp else "\n"
+        stop = list(stop) + [f"{prefix}{other_name}:" for other_name in other_names]
+        # the completions API takes at most four
+        return stop[:MAX_STOP_SEQUENCES]
+
+    def _completion_request(
+        self,
+        prompt: str,
+        other_names: Optional[List[str]] = None,
+        include_timestamp: bool = False,
+    ) -> Tuple[dict, dict]:
+        # use completion api: https://platform.openai.com/docs/api-reference/completions
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        request_body = {"model": self.model, "prompt": prompt, **self.prompt_params}
+        if other_names:
+            request_body["stop"] = self.stop_sequences(other_names, include_timestamp)
+        return headers, request_body
+
+    def _parse_completion_response(
+        self, response_json: dict, name: str, other_names: Optional[List[str]] = None
+    ) -> List[TextResponse]:
+        self.logger.debug(f"LLM response: {response_json}")
+        self.report_usage(response_json.get("usage"), False)
+        raw_response = response_json["choices"][0]["text"]
         cleaned_response = self.conversation_formatter.cleanup_output(
-            raw_response, name
+            raw_response, name, other_names
         )
         return [TextResponse(text=response) for response in cleaned_response]
+
+    def make_completion_request(
+        self,
+        prompt: str,
+        name: str,
+        chat_user_name: str,
+        other_names: Optional[List[str]] = None,
+        include_timestamp: bool = False,
+    ) -> List[TextResponse]:
+        self.logger.debug(f"Making completion request with prompt: {prompt}")
+        headers, request_body = self._completion_request(
+            prompt, other_names, include_timestamp
+        )
+        response = requests.post(
+            self.api_base, headers=headers, json=request_body, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return self._parse_completion_response(response.json(), name, other_names)
+
+    async def amake_completion_request(
+        self,
+        prompt: str,
+        name: str,
+        chat_user_name: str,
+        other_names: Optional[List[str]] = None,
+        include_timestamp: bool = False,
+    ) -> List[TextResponse]:
+        """Async version of `make_completion_request`."""
+        self.logger.debug(f"Making completion request with prompt: {prompt}")
+        headers, request_body = self._completion_request(
+            prompt, other_names, include_timestamp
+        )
+        response = await self._get_async_client().post(
+            self.api_base, headers=headers, json=request_body
+        )
+        response.raise_for_status()
+        return self._parse_completion_response(response.json(), name, other_names)
@@ -1,24 +1,231 @@
-from typing import List
+import asyncio
+import threading
+import time
+from typing import Any, List, Optional
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+def failed_to_connect(e: Exception) -> bool:
+    """Whether a request failed before connecting, so it never reached the server."""
+    if isinstance(
+        e, (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)
+    ):
+        return True
+    # requests also raises ConnectionError when the connection drops after the
+    # request was sent, so look for the underlying error
+    if isinstance(e, requests.ConnectionError) and e.args:
+        return isinstance(getattr(e.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after repeated failures instead of waiting on a dead server.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are refused for `reset_timeout` seconds. After that one call is let
+    through, and its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.n_failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_call(self, name: str):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(
+                    f"{name} is unavailable after {self.n_failures} failures"
+                )
+            # let this call through as a trial, and keep refusing others
+            # until it finishes
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            self.n_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.n_failures += 1
+            if self.n_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
 
 
 class RagModule:
-    def __init__(self, vector_store_endpoint: str):
+    def __init__(
+        self,
+        vector_store_endpoint: str,
+        store_name: Optional[str] = None,
+        timeout: float = 10.0,
+        max_retries: int = 2,
+        retry_backoff: float = 0.2,
+        max_connections: int = 10,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
         self.vector_store_endpoint = vector_store_endpoint
+        # stores hosted together by one server are addressed by name
+        self.api_base = (
+            f"{vector_store_endpoint}/api/{store_name}"
+            if store_name
+            else f"{vector_store_endpoint}/api"
+        )
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_connections = max_connections
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # keep-alive connections reused across calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # async client, tied to the event loop it was made in
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout,
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        """Close pooled connections."""
+        self.session.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+
+    def _should_retry(
+        self, attempt: int, idempotent: bool, status_code: Optional[int]
+    ) -> bool:
+        # a request that failed to connect never reached the server, so it is
+        # safe to repeat; otherwise only idempotent calls are repeated
+        if attempt == self.max_retries:
+            return False
+        if status_code is None:
+            return True
+        return idempotent and status_code in RETRYABLE_STATUS_CODES
+
+    def _record_outcome(self, e: Exception):
+        # a 4xx answer is the request's fault, and shows the server is up
+        if (
+            isinstance(e, (requests.HTTPError, httpx.HTTPStatusError))
+            and e.response.status_code < 500
+        ):
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def _post(self, route: str, payload: dict, idempotent: bool) -> Any:
+        url = f"{self.api_base}/{route}"
+        self.circuit_breaker.before_call(self.api_base)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self.session.post(
+                        url, json=payload, timeout=self.timeout
+                    )
+                except requests.ConnectionError as e:
+                    if not (
+                        failed_to_connect(e)
+                        and self._should_retry(attempt, idempotent, None)
+                    ):
+                        raise
+                else:
+                    if not self._should_retry(
+                        attempt, idempotent, response.status_code
+                    ):
+                        response.raise_for_status()
+                        result = response.json()
+                        break
+                time.sleep(self.retry_backoff * 2**attempt)
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    async def _apost(self, route: str, payload: dict, idempotent: bool) -> Any:
+        url = f"{self.api_base}/{route}"
+        self.circuit_breaker.before_call(self.api_base)
+        client = self._get_async_client()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post(url, json=payload)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if not self._should_retry(attempt, idempotent, None):
+                        raise
+                else:
+                    if not self._should_retry(
+                        attempt, idempotent, response.status_code
+                    ):
+                        response.raise_for_status()
+                        result = response.json()
+                        break
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+        self.circuit_breaker.record_success()
+        return result
 
     def search(self, query: str) -> List[str]:
-        response = requests.post(
-            f"{self.vector_store_endpoint}/api/search",
-            json={"query": query, "n_results": 5},
+        response_json = self._post(
+            "search", {"query": query, "n_results": 5}, idempotent=True
         )
-        response.raise_for_status()
-        response_texts = [result["text"] for result in response.json()["results"]]
-        return response_texts
+        return [result["text"] for result in response_json["results"]]
 
-    def update(self, query: str) -> None:
-        response = requests.post(
-            f"{self.vector_store_endpoint}/api/update",
-            json={"document": query},
+    async def asearch(self, query: str) -> List[str]:
+        response_json = await self._apost(
+            "search", {"query": query, "n_results": 5}, idempotent=True
         )
-        response.raise_for_status()
+        return [result["text"] for result in response_json["results"]]
+
+    def search_many(self, queries: List[str], n_results: int = 5) -> List[List[str]]:
+        response_json = self._post(
+            "search_batch",
+            {"queries": queries, "n_results": n_results},
+            idempotent=True,
+        )
+        return [
+            [result["text"] for result in query_results]
+            for query_results in response_json["results"]
+        ]
+
+    # stores skip documents they already have, so updates are safe to repeat
+    def update(self, query: str) -> None:
+        self._post("update", {"document": query}, idempotent=True)
+
+    async def aupdate(self, query: str) -> None:
+        await self._apost("update", {"document": query}, idempotent=True)
+
+    def update_many(self, documents: List[str]) -> None:
+        self._post("update_batch", {"documents": documents}, idempotent=True)
@@ -30,6 +30,21 @@ class VectorStoreTool(Tool):
         start_time = datetime.now()
         results = self.rag_module.search(query)
         end_time = datetime.now()
+        return self._make_events(query, results, start_time, end_time)
+
+    async def aexecute(self, query: str) -> List[ToolCallEvent]:
+        start_time = datetime.now()
+        results = await self.rag_module.asearch(query)
+        end_time = datetime.now()
+        return self._make_events(query, results, start_time, end_time)
+
+    def _make_events(
+        self,
+        query: str,
+        results: List[str],
+        start_time: datetime,
+        end_time: datetime,
+    ) -> List[ToolCallEvent]:
         return [
             ToolCallEvent(
                 tool_name=self.name,
@@ -1,26 +1,31 @@
 import json
 import os
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 
 from flask import Flask, jsonify, request
 
+from src.retrieval.embedding_core import EmbeddingStore
 from src.retrieval.embedding_factory import EmbeddingStoreFactory
 from src.utils.local_logger import LocalLogger
 
 
-def create_flask_app(
-    config_path: str,
-    logger: LocalLogger,
-):
-    """Create and configure the Flask application with API endpoints.
+def load_stores(
+    config_path: Optional[str], config_dir: Optional[str] = None
+) -> Tuple[Dict[str, EmbeddingStore], Optional[EmbeddingStore]]:
+    """Create the stores a server hosts.
 
     Args:
-        config_path: Path to the configuration file.
+        config_path: Path to the configuration file of a single store.
+        config_dir: Directory of configuration files, one per store. Takes
+            precedence over config_path.
 
     Returns:
-        A configured Flask application
+        Tuple of (stores by name, the store served on the unprefixed /api/...
+        routes, which is None when serving a directory)
     """
-    app = Flask(__name__)
+    if config_dir is not None:
+        return EmbeddingStoreFactory.create_stores(Path(config_dir)), None
 
     # Load config and initialize store
     if config_path is None:
@@ -32,9 +37,47 @@ def create_flask_app(
 
     # Create the embedding store
     embedding_store = EmbeddingStoreFactory.create_store(config)
+    return {Path(config_path).stem: embedding_store}, embedding_store
+
+
+def create_flask_app(
+    config_path: str,
+    logger: LocalLogger,
+    config_dir: Optional[str] = None,
+):
+    """Create and configure the Flask application with API endpoints.
+
+    Each store is served under /api/<store name>/..., where the name is its
+    config file name without .json. When serving a single config, its store
+    is also served under /api/....
+
+    Args:
+        config_path: Path to the configuration file.
+        config_dir: Directory of configuration files to serve together instead.
+
+    Returns:
+        A configured Flask application
+    """
+    app = Flask(__name__)
+    stores, default_store = load_stores(config_path, config_dir)
+
+    def get_store(store_name: Optional[str]) -> Optional[EmbeddingStore]:
+        return default_store if store_name is None else stores.get(store_name)
+
+    def unknown_store(store_name: Optional[str]):
+        if store_name is None:
+            error = f"A store name is required, one of {sorted(stores)}"
+        else:
+            error = f"Unknown store {store_name}"
+        logger.error(error)
+        return jsonify({"error": error}), 404
 
     @app.route("/api/search", methods=["POST"])
-    def search():
+    @app.route("/api/<store_name>/search", methods=["POST"])
+    def search(store_name: Optional[str] = None):
+        embedding_store = get_store(store_name)
+        if embedding_store is None:
+            return unknown_store(store_name)
         data = request.json
         if not data or "query" not in data:
             logger.error("Query is required")
@@ -51,8 +94,38 @@ def create_flask_app(
             logger.error(f"Error searching: {e}")
             return jsonify({"error": str(e)}), 500
 
+    @app.route("/api/search_batch", methods=["POST"])
+    @app.route("/api/<store_name>/search_batch", methods=["POST"])
+    def search_batch(store_name: Optional[str] = None):
+        embedding_store = get_store(store_name)
+        if embedding_store is None:
+            return unknown_store(store_name)
+        data = request.json
+        if not data or not isinstance(data.get("queries"), list):
+            logger.error("A list of queries is required")
+            return jsonify({"error": "A list of queries is required"}), 400
+
+        queries = data["queries"]
+        n_results = data.get("n_results")
+
+        try:
+            results = embedding_store.search_many(queries, n_results)
+            logger.info(f"Batch search results for {len(queries)} queries")
+            logger.debug(f"Batch search results: {results}")
+            return jsonify({"results": results})
+        except ValueError as e:
+            logger.error(f"Invalid batch search request: {e}")
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error searching: {e}")
+            return jsonify({"error": str(e)}), 500
+
     @app.route("/api/update", methods=["POST"])
-    def update():
+    @app.route("/api/<store_name>/update", methods=["POST"])
+    def update(store_name: Optional[str] = None):
+        embedding_store = get_store(store_name)
+        if embedding_store is None:
+            return unknown_store(store_name)
         data = request.json
         if not data or "document" not in data:
             logger.error("Document is required")
@@ -72,10 +145,50 @@ def create_flask_app(
             logger.error(f"Error updating: {e}")
             return jsonify({"error": str(e)}), 500
 
+    @app.route("/api/update_batch", methods=["POST"])
+    @app.route("/api/<store_name>/update_batch", methods=["POST"])
+    def update_batch(store_name: Optional[str] = None):
+        embedding_store = get_store(store_name)
+        if embedding_store is None:
+            return unknown_store(store_name)
+        data = request.json
+        if not data or not isinstance(data.get("documents"), list):
+            logger.error("A list of documents is required")
+            return jsonify({"error": "A list of documents is required"}), 400
+
+        if not embedding_store.allow_update:
+            logger.error("Updates not allowed")
+            return jsonify({"error": "Updates not allowed"}), 403
+
+        documents = data["documents"]
+        metadata = data.get("metadata")
+
+        try:
+            success = embedding_store.update_many(documents, metadata)
+            if success:
+                logger.info(f"Batch update of {len(documents)} documents successful")
+                return jsonify({"status": "success"})
+            else:
+                logger.error("Batch update failed")
+                return jsonify({"error": "Batch update failed"}), 500
+        except ValueError as e:
+            logger.error(f"Invalid batch update request: {e}")
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error updating: {e}")
+            return jsonify({"error": str(e)}), 500
+
     @app.route("/api/health", methods=["GET"])
-    def health():
+    @app.route("/api/<store_name>/health", methods=["GET"])
+    def health(store_name: Optional[str] = None):
         try:
-            status = embedding_store.health_check()
+            if store_name is None and default_store is None:
+                status = {name: store.health_check() for name, store in stores.items()}
+            else:
+                embedding_store = get_store(store_name)
+                if embedding_store is None:
+                    return unknown_store(store_name)
+                status = embedding_store.health_check()
             logger.info("Health check passed")
             return jsonify(status)
         except Exception as e:
@@ -0,0 +1,201 @@
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from src.retrieval.api import load_stores
+from src.retrieval.embedding_core import EmbeddingStore
+from src.utils.local_logger import LocalLogger
+
+
+async def read_json(request: Request) -> Optional[Dict[str, Any]]:
+    """Decode a JSON request body, returning None if it isn't a JSON object."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def create_asgi_app(
+    config_path: str,
+    logger: LocalLogger,
+    config_dir: Optional[str] = None,
+) -> Starlette:
+    """Create an ASGI application with the same API as `create_flask_app`.
+
+    Requests are handled concurrently on an event loop: query embeddings are
+    requested without blocking, and index searches and updates run in
+    worker threads. Stores are built when the app starts up, in a worker
+    thread, since building one can run an event loop of its own.
+
+    Args:
+        config_path: Path to the configuration file.
+        config_dir: Directory of configuration files to serve together instead.
+
+    Returns:
+        A configured Starlette application
+    """
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        app.state.stores, app.state.default_store = await asyncio.to_thread(
+            load_stores, config_path, config_dir
+        )
+        yield
+
+    def get_store(request: Request) -> Optional[EmbeddingStore]:
+        store_name = request.path_params.get("store_name")
+        state = request.app.state
+        return (
+            state.default_store if store_name is None else state.stores.get(store_name)
+        )
+
+    def unknown_store(request: Request) -> JSONResponse:
+        store_name = request.path_params.get("store_name")
+        if store_name is None:
+            error = (
+                f"A store name is required, one of {sorted(request.app.state.stores)}"
+            )
+        else:
+            error = f"Unknown store {store_name}"
+        logger.error(error)
+        return JSONResponse({"error": error}, status_code=404)
+
+    async def search(request: Request) -> JSONResponse:
+        embedding_store = get_store(request)
+        if embedding_store is None:
+            return unknown_store(request)
+        data = await read_json(request)
+        if not data or "query" not in data:
+            logger.error("Query is required")
+            return JSONResponse({"error": "Query is required"}, status_code=400)
+
+        query = data["query"]
+        n_results = data.get("n_results")
+
+        try:
+            results = await embedding_store.asearch(query, n_results)
+            logger.info(f"Search results: {results}")
+            return JSONResponse({"results": results})
+        except Exception as e:
+            logger.error(f"Error searching: {e}")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def search_batch(request: Request) -> JSONResponse:
+        embedding_store = get_store(request)
+        if embedding_store is None:
+            return unknown_store(request)
+        data = await read_json(request)
+        if not data or not isinstance(data.get("queries"), list):
+            logger.error("A list of queries is required")
+            return JSONResponse(
+                {"error": "A list of queries is required"}, status_code=400
+            )
+
+        queries = data["queries"]
+        n_results = data.get("n_results")
+
+        try:
+            results = await embedding_store.asearch_many(queries, n_results)
+            logger.info(f"Batch search results for {len(queries)} queries")
+            logger.debug(f"Batch search results: {results}")
+            return JSONResponse({"results": results})
+        except ValueError as e:
+            logger.error(f"Invalid batch search request: {e}")
+            return JSONResponse({"error": str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error searching: {e}")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def update(request: Request) -> JSONResponse:
+        embedding_store = get_store(request)
+        if embedding_store is None:
+            return unknown_store(request)
+        data = await read_json(request)
+        if not data or "document" not in data:
+            logger.error("Document is required")
+            return JSONResponse({"error": "Document is required"}, status_code=400)
+
+        try:
+            metadata = data.get("metadata", {})
+            document = data["document"]
+            success = await embedding_store.aupdate(document, metadata)
+            if success:
+                logger.info("Update successful")
+                return JSONResponse({"status": "success"})
+            else:
+                logger.error("Updates not allowed")
+                return JSONResponse({"error": "Updates not allowed"}, status_code=403)
+        except Exception as e:
+            logger.error(f"Error updating: {e}")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def update_batch(request: Request) -> JSONResponse:
+        embedding_store = get_store(request)
+        if embedding_store is None:
+            return unknown_store(request)
+        data = await read_json(request)
+        if not data or not isinstance(data.get("documents"), list):
+            logger.error("A list of documents is required")
+            return JSONResponse(
+                {"error": "A list of documents is required"}, status_code=400
+            )
+
+        if not embedding_store.allow_update:
+            logger.error("Updates not allowed")
+            return JSONResponse({"error": "Updates not allowed"}, status_code=403)
+
+        documents = data["documents"]
+        metadata = data.get("metadata")
+
+        try:
+            success = await embedding_store.aupdate_many(documents, metadata)
+            if success:
+                logger.info(f"Batch update of {len(documents)} documents successful")
+                return JSONResponse({"status": "success"})
+            else:
+                logger.error("Batch update failed")
+                return JSONResponse({"error": "Batch update failed"}, status_code=500)
+        except ValueError as e:
+            logger.error(f"Invalid batch update request: {e}")
+            return JSONResponse({"error": str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error updating: {e}")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def health(request: Request) -> JSONResponse:
+        try:
+            state = request.app.state
+            if "store_name" not in request.path_params and state.default_store is None:
+                status = {
+                    name: await asyncio.to_thread(store.health_check)
+                    for name, store in state.stores.items()
+                }
+            else:
+                embedding_store = get_store(request)
+                if embedding_store is None:
+                    return unknown_store(request)
+                status = await asyncio.to_thread(embedding_store.health_check)
+            logger.info("Health check passed")
+            return JSONResponse(status)
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+            return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
+
+    routes = []
+    for prefix in ("/api", "/api/{store_name}"):
+        routes.extend(
+            [
+                Route(f"{prefix}/search", search, methods=["POST"]),
+                Route(f"{prefix}/search_batch", search_batch, methods=["POST"]),
+                Route(f"{prefix}/update", update, methods=["POST"]),
+                Route(f"{prefix}/update_batch", update_batch, methods=["POST"]),
+                Route(f"{prefix}/health", health, methods=["GET"]),
+            ]
+        )
+    return Starlette(routes=routes, lifespan=lifespan)
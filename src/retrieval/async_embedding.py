@@ -0,0 +1,226 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+import httpx
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# connection pool size of the client shared between `embed` calls
+SHARED_CLIENT_MAX_CONNECTIONS = 100
+
+
+def parse_embedding_response(
+    response_json: Dict[str, Any], n_texts: int
+) -> List[List[float]]:
+    """
+    Extract embeddings from an OpenAI-style embeddings response.
+
+    Args:
+        response_json: Decoded JSON body of the response
+        n_texts: Number of texts sent in the request
+
+    Returns:
+        List of embeddings in the same order as the request's input
+    """
+    # the API doesn't promise to return embeddings in input order
+    data = sorted(response_json["data"], key=lambda item: item["index"])
+    if len(data) != n_texts:
+        raise ValueError(f"Expected {n_texts} embeddings, got {len(data)}")
+    return [item["embedding"] for item in data]
+
+
+class AsyncEmbeddingEngine:
+    """Embeds batches of texts concurrently over a pooled HTTP client."""
+
+    def __init__(
+        self,
+        model_name: str,
+        api_base: str,
+        api_key: str,
+        params: dict,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0,
+        timeout: float = 60.0,
+    ):
+        """
+        Initialize the embedding engine.
+
+        Args:
+            model_name: Name of the embedding model
+            api_base: URL of the embeddings endpoint
+            api_key: API key for the embeddings endpoint
+            params: Extra parameters sent with every request
+            max_concurrency: Maximum number of batches in flight at once
+            max_retries: Number of times to retry a batch on 429/5xx or connection errors
+            backoff_seconds: Base delay for exponential backoff between retries
+            max_backoff_seconds: Longest delay between retries, including delays
+                asked for by a Retry-After header
+            timeout: Timeout for a single request in seconds
+        """
+        self.model_name = model_name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.params = params
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+        # long-lived client for `embed`, tied to the event loop it was made in
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def make_client(self, max_connections: Optional[int] = None) -> httpx.AsyncClient:
+        """Create a keep-alive client, by default sized to the concurrency limit."""
+        max_connections = max_connections or self.max_concurrency
+        return httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=self.timeout,
+        )
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        delay = self.backoff_seconds * 2**attempt
+        if response is not None and "retry-after" in response.headers:
+            try:
+                delay = float(response.headers["retry-after"])
+            except ValueError:
+                pass
+        # a server asking for a long wait shouldn't stall the caller for it
+        return min(delay, self.max_backoff_seconds)
+
+    async def embed_batch(
+        self, client: httpx.AsyncClient, texts: List[str]
+    ) -> List[List[float]]:
+        """
+        Embed a batch of texts with one request, retrying transient failures.
+
+        Args:
+            client: Client to send the request with
+            texts: Texts to embed
+
+        Returns:
+            List of embeddings in input order
+        """
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await client.post(
+                    self.api_base,
+                    json={"model": self.model_name, "input": texts, **self.params},
+                )
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            if response is not None:
+                if (
+                    response.status_code not in RETRYABLE_STATUS_CODES
+                    or attempt == self.max_retries
+                ):
+                    response.raise_for_status()
+                    return parse_embedding_response(response.json(), len(texts))
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts with one request over a client shared between calls.
+
+        For latency-sensitive callers such as a server embedding queries,
+        which shouldn't open a new connection per request.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            List of embeddings in input order
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            stale_client, stale_loop = self._client, self._client_loop
+            # concurrent callers are independent requests, such as searches
+            # from different clients, so they aren't held to max_concurrency
+            self._client = self.make_client(SHARED_CLIENT_MAX_CONNECTIONS)
+            self._client_loop = loop
+            if stale_client is not None:
+                self._close_stale_client(stale_client, stale_loop)
+        return await self.embed_batch(self._client, texts)
+
+    def _close_stale_client(
+        self, client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop
+    ):
+        # the client's connections belong to the loop it was made in, so it
+        # has to be closed there; once that loop is closed they can't be shut
+        # down cleanly and are released when the client is garbage collected
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    async def stream(
+        self, batches: Iterable[List[str]]
+    ) -> AsyncIterator[List[List[float]]]:
+        """
+        Embed batches concurrently, yielding results in input order.
+
+        Keeps up to `max_concurrency` batches in flight. Batches are pulled
+        from `batches` lazily, so it may be a generator over a large corpus.
+
+        Args:
+            batches: Lists of texts, each sent as one request
+
+        Yields:
+            List of embeddings for each batch, in the order the batches were given
+        """
+        async with self.make_client() as client:
+            pending = deque()
+            try:
+                for batch in batches:
+                    pending.append(asyncio.create_task(self.embed_batch(client, batch)))
+                    if len(pending) >= self.max_concurrency:
+                        yield await pending.popleft()
+                while pending:
+                    yield await pending.popleft()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    def iter_embeddings(
+        self, batches: Iterable[List[str]]
+    ) -> Iterator[List[List[float]]]:
+        """
+        Synchronous wrapper around `stream`.
+
+        The stream runs on its own event loop in a worker thread, so this can
+        be called from code that is itself running inside an event loop.
+
+        Args:
+            batches: Lists of texts, each sent as one request
+
+        Yields:
+            List of embeddings for each batch, in the order the batches were given
+        """
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        stream = self.stream(batches)
+
+        async def next_embeddings() -> List[List[float]]:
+            return await stream.__anext__()
+
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(
+                        next_embeddings(), loop
+                    ).result()
+                except StopAsyncIteration:
+                    break
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
@@ -0,0 +1,126 @@
+import asyncio
+import sys
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+from llama_index.core.embeddings import BaseEmbedding
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheaply estimate the number of tokens in a text.
+
+    Uses the ~4 characters per token rule of thumb for English text, which is
+    close enough for staying under provider request limits.
+
+    Args:
+        text: The text to estimate
+
+    Returns:
+        Estimated number of tokens
+    """
+    return len(text) // 4 + 1
+
+
+def make_batches(
+    items: Iterable[T],
+    batch_size: int,
+    max_batch_tokens: int,
+    get_text: Callable[[T], str] = str,
+) -> Iterator[List[T]]:
+    """
+    Group items into batches bounded by item count and estimated token count.
+
+    An item whose text alone exceeds the token budget is emitted as a batch of
+    its own rather than dropped.
+
+    Args:
+        items: Items to batch, consumed lazily
+        batch_size: Maximum number of items per batch
+        max_batch_tokens: Maximum estimated tokens per batch
+        get_text: Function returning the text to embed for an item
+
+    Yields:
+        Lists of items, in input order
+    """
+    batch = []
+    batch_tokens = 0
+    for item in items:
+        n_tokens = estimate_tokens(get_text(item))
+        if batch and (
+            len(batch) >= batch_size or batch_tokens + n_tokens > max_batch_tokens
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += n_tokens
+    if batch:
+        yield batch
+
+
+def embed_in_batches(
+    embed_model: BaseEmbedding,
+    items: Iterable[T],
+    get_text: Callable[[T], str] = str,
+) -> Iterator[Tuple[List[T], List[List[float]]]]:
+    """
+    Embed a stream of items batch by batch.
+
+    Models that provide their own `embed_in_batches` (e.g. a remote model that
+    keeps several requests in flight) are used directly; anything else falls
+    back to `get_text_embedding_batch` over `embed_batch_size` chunks.
+
+    Args:
+        embed_model: The embedding model
+        items: Items to embed, consumed lazily
+        get_text: Function returning the text to embed for an item
+
+    Yields:
+        Tuples of (batch of items, their embeddings), in input order
+    """
+    if hasattr(embed_model, "embed_in_batches"):
+        yield from embed_model.embed_in_batches(items, get_text)
+        return
+    for batch in make_batches(
+        items, embed_model.embed_batch_size, sys.maxsize, get_text
+    ):
+        yield batch, embed_model.get_text_embedding_batch(
+            [get_text(item) for item in batch]
+        )
+
+
+async def aget_query_embedding_batch(
+    embed_model: BaseEmbedding, queries: List[str]
+) -> List[List[float]]:
+    """
+    Async version of `get_query_embedding_batch`.
+
+    Falls back to embedding the queries concurrently, one request each.
+    """
+    if hasattr(embed_model, "aget_query_embedding_batch"):
+        return await embed_model.aget_query_embedding_batch(queries)
+    return list(
+        await asyncio.gather(
+            *(embed_model.aget_query_embedding(query) for query in queries)
+        )
+    )
+
+
+def get_query_embedding_batch(
+    embed_model: BaseEmbedding, queries: List[str]
+) -> List[List[float]]:
+    """
+    Embed several queries, batched where the model supports it.
+
+    Args:
+        embed_model: The embedding model
+        queries: Queries to embed
+
+    Returns:
+        List of query embeddings, in query order
+    """
+    if hasattr(embed_model, "get_query_embedding_batch"):
+        return embed_model.get_query_embedding_batch(queries)
+    return [embed_model.get_query_embedding(query) for query in queries]
@@ -1,21 +1,90 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pydantic import BaseModel
 
+from src.retrieval.batching import estimate_tokens
+
+# characters read from a text document at a time
+TXT_READ_SIZE = 1 << 20
+# rows read from a parquet file at a time
+PARQUET_READ_BATCH_SIZE = 8192
+# documents handed from ingestion workers to the parent process
+IPC_SCHEMA = pa.schema(
+    [
+        ("key", pa.binary(16)),
+        ("text", pa.string()),
+        ("metadata", pa.string()),
+    ]
+)
+
 
 class EmbedDocument(BaseModel):
     text: str
     metadata: Dict[str, str]
 
 
+def iter_txt_documents(
+    document_path: Path,
+    delimiter: str = "\n-----\n",
+    read_size: int = TXT_READ_SIZE,
+) -> Iterator[EmbedDocument]:
+    """
+    Stream the chunks of a text document without reading it all into memory.
+
+    Yields the same chunks as `str.split(delimiter)` on the whole file,
+    including delimiters that straddle two reads.
+
+    Args:
+        document_path: Path to the text document
+        delimiter: Delimiter to split the document by
+        read_size: Number of characters to read at a time
+
+    Yields:
+        Documents, one per chunk
+    """
+    with open(document_path, "r") as file:
+        buffer = ""
+        while True:
+            block = file.read(read_size)
+            if not block:
+                break
+            # only the tail of the old buffer can start a delimiter that ends in block
+            search_from = max(len(buffer) - len(delimiter) + 1, 0)
+            buffer += block
+            start = 0
+            end = buffer.find(delimiter, search_from)
+            while end != -1:
+                yield EmbedDocument.model_construct(text=buffer[start:end], metadata={})
+                start = end + len(delimiter)
+                end = buffer.find(delimiter, start)
+            buffer = buffer[start:]
+        yield EmbedDocument.model_construct(text=buffer, metadata={})
+
+
 def prep_txt_document(
     document_path: Path, delimiter: str = "\n-----\n"
 ) -> List[EmbedDocument]:
     """
     Prepare a text document for indexing by splitting it into chunks.
 
+    Reads everything into memory; use `iter_txt_documents` to stream large
+    documents.
+
     Args:
         document_path: Path to the text document
         delimiter: Delimiter to split the document by
@@ -25,44 +94,359 @@ def prep_txt_document(
         - "text": The text of the document chunk
         - "metadata" (optional): The metadata of the document chunk, in JSON format
     """
-    with open(document_path, "r") as file:
-        full_document = file.read()
-    document_texts = full_document.split(delimiter)
-    documents = [EmbedDocument(text=text, metadata={}) for text in document_texts]
-    return documents
+    return list(iter_txt_documents(document_path, delimiter))
 
 
-def prep_parquet(document_path: Path) -> List[Dict]:
+def split_text(text: str, max_tokens: int) -> List[str]:
     """
-    Prepare a parquet document or directory of parquet documents for indexing.
+    Split a text into pieces of at most roughly `max_tokens` tokens.
+
+    Splits on line breaks where possible, falling back to spaces and then to
+    raw character offsets for lines that are too long on their own.
+
+    Args:
+        text: The text to split
+        max_tokens: Maximum estimated tokens per piece
+
+    Returns:
+        List of pieces, which join back into the original text
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    max_chars = max(max_tokens * 4 - 1, 1)
+    pieces = []
+    current = ""
+    for segment in re.split(r"(?<=\n)|(?<= )", text):
+        while len(segment) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(segment[:max_chars])
+            segment = segment[max_chars:]
+        if len(current) + len(segment) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += segment
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def parquet_files(document_path: Path) -> List[Path]:
+    """List the parquet files at a path, which may be a file or a directory."""
+    if document_path.is_file():
+        return [document_path]
+    return sorted(document_path.glob("*.parquet"))
+
+
+def iter_parquet_batches(
+    document_path: Path, batch_size: int = PARQUET_READ_BATCH_SIZE
+) -> Iterator[pa.RecordBatch]:
+    """
+    Stream the text and metadata columns of parquet documents in record batches.
+
+    Files are read one row group at a time, so memory use doesn't depend on
+    the size of the files.
 
     Args:
         document_path: Path to the parquet document or directory of parquet documents
+        batch_size: Maximum number of rows per batch
+
+    Yields:
+        Record batches with a "text" column and, if present, a "metadata" column
+    """
+    for parquet_file in parquet_files(document_path):
+        file = pq.ParquetFile(parquet_file)
+        columns = [
+            name for name in ("text", "metadata") if name in file.schema_arrow.names
+        ]
+        yield from file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def _stringify_metadata(metadata: Any) -> Dict[str, str]:
+    if metadata is None:
+        return {}
+    # map columns come back as lists of (key, value) pairs
+    if isinstance(metadata, list):
+        metadata = dict(metadata)
+    return {k: str(v) for k, v in metadata.items()}
+
+
+def _document_columns(batch: pa.RecordBatch) -> Tuple[List[Any], List[Any]]:
+    """Text and raw metadata columns of a record batch, filling in missing columns."""
+    texts = (
+        batch.column("text").to_pylist()
+        if "text" in batch.schema.names
+        else [""] * batch.num_rows
+    )
+    metadata = (
+        batch.column("metadata").to_pylist()
+        if "metadata" in batch.schema.names
+        else [None] * batch.num_rows
+    )
+    return texts, metadata
+
+
+def iter_parquet_documents(document_path: Path) -> Iterator[EmbedDocument]:
+    """
+    Stream documents from a parquet document or directory of parquet documents.
+
+    Args:
+        document_path: Path to the parquet document or directory of parquet documents
+
+    Yields:
+        Documents, in file and row order
+    """
+    for batch in iter_parquet_batches(document_path):
+        for text, meta in zip(*_document_columns(batch)):
+            # skip validation, the fields are already the right types
+            yield EmbedDocument.model_construct(
+                text=text or "", metadata=_stringify_metadata(meta)
+            )
+
+
+def document_key(text: str, metadata: str) -> bytes:
+    """Key identifying duplicate documents, given their text and metadata JSON."""
+    return hashlib.blake2b(
+        f"{text}\0{metadata}".encode("utf-8"), digest_size=16
+    ).digest()
+
+
+def _normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def deduplicate_documents(
+    documents: Iterable[EmbedDocument],
+) -> Iterator[EmbedDocument]:
+    """
+    Normalize document text and drop empty and duplicate documents.
+
+    Text is normalized to Unicode NFC with surrounding whitespace stripped,
+    and documents with the same text and metadata as an earlier one are
+    dropped.
+
+    Args:
+        documents: Documents to filter
+
+    Yields:
+        The first copy of each non-empty document, with normalized text
+    """
+    seen = set()
+    n_read = n_kept = 0
+    for document in documents:
+        n_read += 1
+        text = _normalize_text(document.text)
+        if not text:
+            continue
+        key = document_key(text, json.dumps(document.metadata, sort_keys=True))
+        if key in seen:
+            continue
+        seen.add(key)
+        n_kept += 1
+        yield EmbedDocument.model_construct(text=text, metadata=document.metadata)
+    print(f"Dropped {n_read - n_kept} empty or duplicate documents")
+
+
+def _parse_parquet_file(
+    parquet_file: Path, output_dir: str, deduplicate: bool
+) -> Tuple[str, int]:
+    """
+    Parse one parquet file in a worker process, optionally normalizing and
+    deduplicating its documents.
+
+    Documents are written to an Arrow IPC file rather than returned, so they
+    aren't pickled on their way back to the parent process.
+
+    Args:
+        parquet_file: The parquet file to parse
+        output_dir: Directory to write the Arrow IPC file to
+        deduplicate: Whether to normalize text and drop empty and duplicate
+            documents (see `deduplicate_documents`)
 
     Returns:
-        List of dictionaries containing the document chunks, where each dictionary has the following keys:
-        - "text": The text of the document chunk
-        - "metadata" (optional): The metadata of the document chunk, in JSON format
+        Tuple of (IPC file path, number of rows read)
+    """
+    fd, ipc_path = tempfile.mkstemp(suffix=".arrow", dir=output_dir)
+    os.close(fd)
+    seen = set()
+    n_read = 0
+    with pa.OSFile(ipc_path, "wb") as sink:
+        with pa.ipc.new_file(sink, IPC_SCHEMA) as writer:
+            for batch in iter_parquet_batches(parquet_file):
+                n_read += batch.num_rows
+                columns = ([], [], [])
+                for text, metadata in zip(*_document_columns(batch)):
+                    text = text or ""
+                    metadata = json.dumps(_stringify_metadata(metadata), sort_keys=True)
+                    key = None
+                    if deduplicate:
+                        text = _normalize_text(text)
+                        if not text:
+                            continue
+                        key = document_key(text, metadata)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    for column, value in zip(columns, (key, text, metadata)):
+                        column.append(value)
+                writer.write_batch(pa.record_batch(list(columns), schema=IPC_SCHEMA))
+    return ipc_path, n_read
+
+
+def iter_parquet_documents_parallel(
+    document_path: Path, workers: int, deduplicate: bool = False
+) -> Iterator[EmbedDocument]:
+    """
+    Parse a directory of parquet documents with a pool of worker processes.
+
+    Each worker hands its documents back through an Arrow IPC file in shared
+    memory (/dev/shm) where available, and files are merged back in order.
+    When deduplicating, each worker normalizes text and drops empty and
+    duplicate documents within its file, and the merge drops documents
+    already seen in earlier files.
+
+    Args:
+        document_path: Path to the parquet document or directory of parquet documents
+        workers: Number of worker processes
+        deduplicate: Whether to normalize text and drop empty and duplicate
+            documents (see `deduplicate_documents`)
+
+    Yields:
+        Documents, in file and row order
     """
+    files = parquet_files(document_path)
+    output_dir = tempfile.mkdtemp(
+        prefix="ingest-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+    seen = set()
+    n_read = n_kept = 0
+    try:
+        # forking would copy the locks of threads already running in this
+        # process (embedding micro-batchers, index compaction) in whatever
+        # state they are in, so workers start fresh instead
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            # keep a few files ahead of the consumer, but not the whole corpus
+            pending = deque()
+            files = iter(files)
+            for parquet_file in itertools.islice(files, 2 * workers):
+                pending.append(
+                    executor.submit(
+                        _parse_parquet_file, parquet_file, output_dir, deduplicate
+                    )
+                )
+            while pending:
+                ipc_path, n_file_read = pending.popleft().result()
+                n_read += n_file_read
+                parquet_file = next(files, None)
+                if parquet_file is not None:
+                    pending.append(
+                        executor.submit(
+                            _parse_parquet_file, parquet_file, output_dir, deduplicate
+                        )
+                    )
+                with pa.memory_map(ipc_path) as source:
+                    reader = pa.ipc.open_file(source)
+                    for i in range(reader.num_record_batches):
+                        batch = reader.get_batch(i)
+                        for key, text, meta in zip(
+                            batch.column("key").to_pylist(),
+                            batch.column("text").to_pylist(),
+                            batch.column("metadata").to_pylist(),
+                        ):
+                            if deduplicate:
+                                if key in seen:
+                                    continue
+                                seen.add(key)
+                            n_kept += 1
+                            yield EmbedDocument.model_construct(
+                                text=text, metadata=json.loads(meta)
+                            )
+                os.remove(ipc_path)
+        if deduplicate:
+            print(f"Dropped {n_read - n_kept} empty or duplicate documents")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
 
-    documents = []
 
-    # Handle both single file and directory cases
-    parquet_files = (
-        [document_path]
-        if document_path.is_file()
-        else list(document_path.glob("*.parquet"))
+def report_throughput(
+    documents: Iterable[EmbedDocument], interval: float = 10.0
+) -> Iterator[EmbedDocument]:
+    """Pass documents through, printing how many are read per second."""
+    start = last_report = time.monotonic()
+    n_documents = 0
+    for document in documents:
+        n_documents += 1
+        yield document
+        now = time.monotonic()
+        if now - last_report >= interval:
+            print(
+                f"Read {n_documents} documents "
+                f"({n_documents / (now - start):.0f} docs/sec)"
+            )
+            last_report = now
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(
+        f"Read {n_documents} documents in {elapsed:.1f}s ({n_documents / elapsed:.0f} docs/sec)"
     )
 
-    for parquet_file in parquet_files:
-        df = pd.read_parquet(parquet_file)
 
-        # Convert each row to a dictionary
-        for _, row in df.iterrows():
-            doc_text = row.get("text", "")
-            doc_meta = row.get("metadata", {})
-            # stringify metadata
-            doc_meta = {k: str(v) for k, v in doc_meta.items()}
-            documents.append(EmbedDocument(text=doc_text, metadata=doc_meta))
+def iter_documents(
+    document_path: Path,
+    max_document_tokens: Optional[int] = None,
+    workers: int = 1,
+    deduplicate: bool = False,
+) -> Iterator[EmbedDocument]:
+    """
+    Stream documents from a .txt document or parquet document(s).
+
+    Args:
+        document_path: Path to the documents
+        max_document_tokens: If set, documents longer than this many estimated
+            tokens are split into several documents with the same metadata
+        workers: Number of processes to parse parquet files with
+        deduplicate: Whether to normalize text and drop empty and duplicate
+            documents (see `deduplicate_documents`)
+
+    Yields:
+        Documents to index
+    """
+    if document_path.suffix == ".txt":
+        documents = iter_txt_documents(document_path)
+    elif workers > 1:
+        # workers deduplicate as they parse
+        documents = iter_parquet_documents_parallel(document_path, workers, deduplicate)
+        deduplicate = False
+    else:
+        documents = iter_parquet_documents(document_path)
+    if deduplicate:
+        documents = deduplicate_documents(documents)
+    documents = report_throughput(documents)
+    if max_document_tokens is None:
+        yield from documents
+        return
+    for document in documents:
+        for text in split_text(document.text, max_document_tokens):
+            yield EmbedDocument.model_construct(
+                text=text, metadata=dict(document.metadata)
+            )
+
 
-    return documents
+def prep_parquet(document_path: Path) -> List[EmbedDocument]:
+    """
+    Prepare a parquet document or directory of parquet documents for indexing.
+
+    Reads everything into memory; use `iter_parquet_documents` to stream
+    large corpora.
+
+    Args:
+        document_path: Path to the parquet document or directory of parquet documents
+
+    Returns:
+        List of dictionaries containing the document chunks, where each dictionary has the following keys:
+        - "text": The text of the document chunk
+        - "metadata" (optional): The metadata of the document chunk, in JSON format
+    """
+    return list(iter_parquet_documents(document_path))
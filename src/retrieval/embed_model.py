@@ -1,13 +1,38 @@
-import asyncio
 import json
+from collections import deque
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 import requests
 from llama_index.core.embeddings import BaseEmbedding
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from pydantic import PrivateAttr
 
+from src.retrieval.async_embedding import (
+    AsyncEmbeddingEngine,
+    parse_embedding_response,
+)
+from src.retrieval.batching import make_batches
 from src.retrieval.documents import EmbedDocument
+from src.retrieval.embedding_cache import (
+    CacheInUseError,
+    CachedEmbeddingModel,
+    EmbeddingCache,
+    cache_namespace,
+)
+from src.retrieval.micro_batching import (
+    DEFAULT_MAX_BATCH_SIZE,
+    DEFAULT_MAX_WAIT_MS,
+    MicroBatchingEmbedding,
+)
+
+DEFAULT_BATCH_SIZE = 128
+DEFAULT_MAX_BATCH_TOKENS = 100000
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_CACHE_MAX_ENTRIES = 200000
+
+T = TypeVar("T")
 
 
 class RemoteEmbeddingModel(BaseEmbedding):
@@ -15,24 +40,57 @@ class RemoteEmbeddingModel(BaseEmbedding):
     api_base: str
     api_key: str
     params: dict
+    batch_size: int
+    max_batch_tokens: int
+    _engine: AsyncEmbeddingEngine = PrivateAttr()
 
-    def __init__(self, model_name: str, api_base: str, api_key: str, params: dict):
+    def __init__(
+        self,
+        model_name: str,
+        api_base: str,
+        api_key: str,
+        params: dict,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
         super().__init__(
-            model_name=model_name, api_base=api_base, api_key=api_key, params=params
+            model_name=model_name,
+            api_base=api_base,
+            api_key=api_key,
+            params=params,
+            batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            embed_batch_size=batch_size,
         )
         self.model_name = model_name
         self.api_base = api_base
         self.api_key = api_key
         self.params = params
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self._engine = AsyncEmbeddingEngine(
+            model_name,
+            api_base,
+            api_key,
+            params,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+        )
 
-    def _infer(self, text: str) -> List[float]:
+    def _infer_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts with a single request to the embeddings API."""
         response = requests.post(
             self.api_base,
             headers={"Authorization": f"Bearer {self.api_key}"},
-            json={"model": self.model_name, "input": text, **self.params},
+            json={"model": self.model_name, "input": texts, **self.params},
         )
         response.raise_for_status()
-        return response.json()["data"][0]["embedding"]
+        return parse_embedding_response(response.json(), len(texts))
+
+    def _infer(self, text: str) -> List[float]:
+        return self._infer_batch([text])[0]
 
     def _get_query_embedding(self, query: str) -> List[float]:
         return self._infer(query)
@@ -41,24 +99,100 @@ class RemoteEmbeddingModel(BaseEmbedding):
         return self._infer(text)
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
-        return await asyncio.to_thread(self._get_text_embedding, text)
+        return (await self._aget_text_embeddings([text]))[0]
 
     async def _aget_query_embedding(self, query: str) -> List[float]:
-        return await asyncio.to_thread(self._get_query_embedding, query)
+        return (await self._engine.embed([query]))[0]
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return [self._get_text_embedding(text) for text in texts]
+        embeddings = []
+        for batch in make_batches(texts, self.batch_size, self.max_batch_tokens):
+            embeddings.extend(self._infer_batch(batch))
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        async for batch_embeddings in self._engine.stream(
+            make_batches(texts, self.batch_size, self.max_batch_tokens)
+        ):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries, packing them into as few requests as possible."""
+        # queries and documents are embedded the same way by embeddings APIs
+        return self._get_text_embeddings(queries)
 
+    async def aget_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """Async version of `get_query_embedding_batch`."""
+        embeddings = []
+        for batch in make_batches(queries, self.batch_size, self.max_batch_tokens):
+            embeddings.extend(await self._engine.embed(batch))
+        return embeddings
 
-def make_embed_model(config_path: Path) -> BaseEmbedding:
+    def embed_in_batches(
+        self, items: Iterable[T], get_text: Callable[[T], str] = str
+    ) -> Iterator[Tuple[List[T], List[List[float]]]]:
+        """
+        Embed items with several batches in flight at once.
+
+        Args:
+            items: Items to embed, consumed lazily
+            get_text: Function returning the text to embed for an item
+
+        Yields:
+            Tuples of (batch of items, their embeddings), in input order
+        """
+        item_batches = deque()
+
+        def text_batches():
+            for batch in make_batches(
+                items, self.batch_size, self.max_batch_tokens, get_text
+            ):
+                item_batches.append(batch)
+                yield [get_text(item) for item in batch]
+
+        for embeddings in self._engine.iter_embeddings(text_batches()):
+            yield item_batches.popleft(), embeddings
+
+
+def make_embed_model(
+    config_path: Path, cache_dir: Optional[Path] = None
+) -> BaseEmbedding:
     with open(config_path, "r") as f:
         config = json.load(f)
+    # a store can give its model a cache of its own, since a cache directory
+    # can't be shared by processes serving different stores
+    if cache_dir is not None:
+        config["cache_dir"] = str(cache_dir)
     if config["api_base"]:
-        return RemoteEmbeddingModel(
+        embed_model = RemoteEmbeddingModel(
             config["model_name"],
             config["api_base"],
             config["api_key"],
             config["params"],
+            config.get("batch_size", DEFAULT_BATCH_SIZE),
+            config.get("max_batch_tokens", DEFAULT_MAX_BATCH_TOKENS),
+            config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            config.get("max_retries", DEFAULT_MAX_RETRIES),
         )
     else:
-        return HuggingFaceEmbedding(model_name=config["model_name"])
+        embed_model = MicroBatchingEmbedding(
+            HuggingFaceEmbedding(model_name=config["model_name"]),
+            config.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE),
+            config.get("max_wait_ms", DEFAULT_MAX_WAIT_MS),
+        )
+    if config.get("cache_dir"):
+        try:
+            cache = EmbeddingCache(
+                Path(config["cache_dir"])
+                / cache_namespace(config["model_name"], config["params"]),
+                config.get("cache_max_entries", DEFAULT_CACHE_MAX_ENTRIES),
+            )
+        except CacheInUseError as e:
+            # e.g. another server worker; only index builds benefit from the
+            # cache, and those run in one process
+            print(f"Not caching embeddings: {e}")
+        else:
+            embed_model = CachedEmbeddingModel(embed_model, cache)
+    return embed_model
@@ -0,0 +1,349 @@
+import fcntl
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from pydantic import PrivateAttr
+
+from src.retrieval.batching import (
+    aget_query_embedding_batch,
+    embed_in_batches,
+    get_query_embedding_batch,
+    make_batches,
+)
+
+T = TypeVar("T")
+
+# number of items looked up in the cache at once when streaming
+CACHE_WINDOW_SIZE = 1024
+# sqlite's default limit on host parameters in a single statement
+SQLITE_MAX_VARIABLES = 900
+
+
+class CacheInUseError(Exception):
+    pass
+
+
+def cache_namespace(model_name: str, params: Dict[str, Any]) -> str:
+    """Name of the cache directory for a model and its request parameters."""
+    key = json.dumps({"model_name": model_name, "params": params}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of text embeddings for a single model.
+
+    Vectors live in a memory-mapped float32 file with one row per entry, and a
+    SQLite index maps sha256(text) to its row and last access time. When the
+    cache is full, the least recently used entries are evicted and their rows
+    reused.
+
+    A cache directory can only be open in one process at a time, since each
+    process keeps its own view of the vector file; other processes get a
+    CacheInUseError.
+    """
+
+    def __init__(self, cache_dir: Path, max_entries: int):
+        """
+        Open or create an embedding cache.
+
+        Args:
+            cache_dir: Directory holding the cache files for one model/params pair
+            max_entries: Maximum number of embeddings to keep
+
+        Raises:
+            CacheInUseError: If another process has the cache open
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.vectors_path = cache_dir / "vectors.f32"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # held for as long as the process runs, and released by the OS if it dies
+        self._lock_file = open(cache_dir / "lock", "w")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise CacheInUseError(f"{cache_dir} is in use by another process")
+        self._conn = sqlite3.connect(
+            cache_dir / "index.sqlite", check_same_thread=False
+        )
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+            """
+        )
+        self.dimension = self._get_meta("dimension")
+        self._n_rows = self._get_meta("n_rows") or 0
+        self._clock = (
+            self._conn.execute("SELECT MAX(last_used) FROM entries").fetchone()[0] or 0
+        )
+        self._vectors = None
+        if self.dimension is not None:
+            self._open_vectors(max(self._n_rows, 1))
+
+    def _get_meta(self, name: str) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value: int):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    def _open_vectors(self, capacity: int):
+        """Map the vector file, growing it to hold at least `capacity` rows."""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        n_bytes = capacity * self.dimension * 4
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < n_bytes:
+                f.truncate(n_bytes)
+        capacity = self.vectors_path.stat().st_size // (self.dimension * 4)
+        self._vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(capacity, self.dimension),
+        )
+
+    def _lookup_rows(self, keys: List[str]) -> Dict[str, int]:
+        rows = {}
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(
+                self._conn.execute(
+                    f"SELECT key, row FROM entries WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            )
+        return rows
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            texts: Texts to look up
+
+        Returns:
+            List with the cached embedding for each text, or None on a miss
+        """
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            if self._vectors is None:
+                self.misses += len(texts)
+                return [None] * len(texts)
+            rows = self._lookup_rows(keys)
+            self._clock += 1
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(self._clock, key) for key in rows],
+            )
+            self._conn.commit()
+            results = [
+                self._vectors[rows[key]].tolist() if key in rows else None
+                for key in keys
+            ]
+            n_hits = sum(result is not None for result in results)
+            self.hits += n_hits
+            self.misses += len(texts) - n_hits
+        return results
+
+    def _allocate_rows(self, n: int) -> List[int]:
+        """Find `n` unused rows, evicting least recently used entries if needed."""
+        # rows are only freed by eviction, which hands them straight to new entries
+        n_new = min(n, self.max_entries - self._n_rows)
+        rows = list(range(self._n_rows, self._n_rows + n_new))
+        self._n_rows += n_new
+        self._set_meta("n_rows", self._n_rows)
+        if len(rows) < n:
+            evicted = self._conn.execute(
+                "SELECT key, row FROM entries ORDER BY last_used LIMIT ?",
+                (n - len(rows),),
+            ).fetchall()
+            self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted]
+            )
+            rows.extend(row for _, row in evicted)
+        if self._n_rows > len(self._vectors):
+            self._open_vectors(
+                min(max(self._n_rows, 2 * len(self._vectors)), self.max_entries)
+            )
+        return rows
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """
+        Add embeddings to the cache.
+
+        Args:
+            texts: Texts that were embedded
+            embeddings: Embedding for each text
+        """
+        if not texts:
+            return
+        new_entries = dict(zip((text_key(text) for text in texts), embeddings))
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = len(embeddings[0])
+                self._set_meta("dimension", self.dimension)
+                self._open_vectors(1)
+            existing = self._lookup_rows(list(new_entries))
+            for key in existing:
+                del new_entries[key]
+            if not new_entries:
+                return
+            # evicting can't make room for more than max_entries at once
+            new_entries = dict(list(new_entries.items())[-self.max_entries :])
+            rows = self._allocate_rows(len(new_entries))
+            # evicted entries must be gone from disk before their rows are
+            # overwritten, or a crash could map their keys to other vectors;
+            # a crash before the insert below only leaves the rows unused
+            self._conn.commit()
+            self._vectors[rows] = np.asarray(
+                list(new_entries.values()), dtype=np.float32
+            )
+            # vectors must be on disk before the index points at them
+            self._vectors.flush()
+            self._clock += 1
+            self._conn.executemany(
+                "INSERT INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                [(key, row, self._clock) for key, row in zip(new_entries, rows)],
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n_entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "entries": n_entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class CachedEmbeddingModel(BaseEmbedding):
+    """Embedding model wrapper that serves repeated texts from an EmbeddingCache."""
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache):
+        super().__init__(
+            model_name=inner.model_name, embed_batch_size=inner.embed_batch_size
+        )
+        self._inner = inner
+        self._cache = cache
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _embed_with_cache(
+        self, texts: List[str], embed_misses: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        embeddings = self._cache.get_many(texts)
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            miss_embeddings = embed_misses(miss_texts)
+            self._cache.put_many(miss_texts, miss_embeddings)
+            for i, embedding in zip(misses, miss_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        # queries may be embedded differently from documents, so they aren't cached
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._inner.aget_query_embedding(query)
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return get_query_embedding_batch(self._inner, queries)
+
+    async def aget_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return await aget_query_embedding_batch(self._inner, queries)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_with_cache(texts, self._inner.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self._cache.get_many(texts)
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            miss_embeddings = await self._inner.aget_text_embedding_batch(miss_texts)
+            self._cache.put_many(miss_texts, miss_embeddings)
+            for i, embedding in zip(misses, miss_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    def embed_in_batches(
+        self, items: Iterable[T], get_text: Callable[[T], str] = str
+    ) -> Iterator[Tuple[List[T], List[List[float]]]]:
+        """
+        Embed a stream of items, only sending cache misses to the wrapped model.
+
+        Args:
+            items: Items to embed, consumed lazily
+            get_text: Function returning the text to embed for an item
+
+        Yields:
+            Tuples of (batch of items, their embeddings), in input order
+        """
+
+        def embed_misses(texts: List[str]) -> List[List[float]]:
+            embeddings = []
+            for _, batch_embeddings in embed_in_batches(self._inner, texts):
+                embeddings.extend(batch_embeddings)
+            return embeddings
+
+        for window in make_batches(items, CACHE_WINDOW_SIZE, sys.maxsize, get_text):
+            texts = [get_text(item) for item in window]
+            yield window, self._embed_with_cache(texts, embed_misses)
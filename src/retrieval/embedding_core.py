@@ -1,10 +1,71 @@
+import asyncio
+import hashlib
+import json
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
+
+
+def document_id(text: str, metadata: Dict[str, Any]) -> str:
+    """Deterministic id for a document, so adding it again can be detected."""
+    key = json.dumps({"text": text, "metadata": metadata}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def resolve_n_results(
+    n_queries: int,
+    n_results: Optional[Union[int, List[Optional[int]]]],
+    default_n_results: int,
+) -> List[int]:
+    """
+    Expand a shared or per-query n_results argument into one count per query.
+
+    Args:
+        n_queries: Number of queries
+        n_results: None, a single count for all queries, or a list with one
+            (possibly None) count per query
+        default_n_results: Count to use where none is given
+
+    Returns:
+        List with the number of results to return for each query
+    """
+    if not isinstance(n_results, list):
+        n_results = [n_results] * n_queries
+    if len(n_results) != n_queries:
+        raise ValueError(
+            f"Got {len(n_results)} n_results values for {n_queries} queries"
+        )
+    return [n if n is not None else default_n_results for n in n_results]
+
+
+def resolve_metadata(
+    n_documents: int, metadata: Optional[List[Optional[Dict[str, Any]]]]
+) -> List[Dict[str, Any]]:
+    """
+    Expand an optional list of per-document metadata into one dict per document.
+
+    Args:
+        n_documents: Number of documents
+        metadata: None, or a list with one (possibly None) dict per document
+
+    Returns:
+        List with the metadata of each document
+    """
+    if metadata is None:
+        metadata = [None] * n_documents
+    if len(metadata) != n_documents:
+        raise ValueError(
+            f"Got {len(metadata)} metadata values for {n_documents} documents"
+        )
+    return [meta or {} for meta in metadata]
 
 
 class EmbeddingStore(ABC):
     """Abstract base class for embedding stores."""
 
+    # whether update and update_many add documents; stores that can be read-only
+    # override this
+    allow_update: bool = True
+
     @abstractmethod
     def search(
         self, query: str, n_results: Optional[int] = None
@@ -21,6 +82,48 @@ class EmbeddingStore(ABC):
         """
         pass
 
+    def search_many(
+        self,
+        queries: List[str],
+        n_results: Optional[Union[int, List[Optional[int]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search for documents similar to each of several queries.
+
+        Stores that can embed and search queries together should override this;
+        the default runs one search per query.
+
+        Args:
+            queries: The search queries
+            n_results: Number of results to return, either shared by all
+                queries or given per query (overrides default)
+
+        Returns:
+            List with the search results for each query, in query order
+        """
+        if not isinstance(n_results, list):
+            n_results = [n_results] * len(queries)
+        return [self.search(query, n) for query, n in zip(queries, n_results)]
+
+    async def asearch(
+        self, query: str, n_results: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of `search`, for serving from an event loop.
+
+        Stores should override this to embed the query without blocking; the
+        default runs `search` in a worker thread.
+        """
+        return await asyncio.to_thread(self.search, query, n_results)
+
+    async def asearch_many(
+        self,
+        queries: List[str],
+        n_results: Optional[Union[int, List[Optional[int]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Async version of `search_many`; the default runs it in a worker thread."""
+        return await asyncio.to_thread(self.search_many, queries, n_results)
+
     @abstractmethod
     def update(self, document: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
         """
@@ -35,6 +138,44 @@ class EmbeddingStore(ABC):
         """
         pass
 
+    async def aupdate(
+        self, document: str, metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Async version of `update`; the default runs it in a worker thread."""
+        return await asyncio.to_thread(self.update, document, metadata)
+
+    def update_many(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """
+        Add several documents to the embedding store.
+
+        Stores that can embed and insert documents together should override
+        this; the default adds them one at a time and stops at the first
+        failure, so earlier documents may already have been added.
+
+        Args:
+            documents: The document texts to add
+            metadata: Optional metadata for each document
+
+        Returns:
+            Boolean indicating if every document was added
+        """
+        metadata = resolve_metadata(len(documents), metadata)
+        return all(
+            self.update(document, meta) for document, meta in zip(documents, metadata)
+        )
+
+    async def aupdate_many(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """Async version of `update_many`; the default runs it in a worker thread."""
+        return await asyncio.to_thread(self.update_many, documents, metadata)
+
     @abstractmethod
     def health_check(self) -> Dict[str, Any]:
         """
@@ -1,21 +1,68 @@
+import json
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
+from llama_index.core.embeddings import BaseEmbedding
+
+from src.retrieval.embed_model import make_embed_model
 from src.retrieval.embedding_core import EmbeddingStore
 from src.retrieval.local_embedding_store import LocalEmbeddingStore
+from src.retrieval.query_cache import QueryEmbeddingCache
 from src.retrieval.zilliz_embedding_store import ZillizEmbeddingStore
 
 
+class EmbeddingModelRegistry:
+    """
+    Embedding models and query caches shared by the stores of one process.
+
+    Stores with the same embedding config get the same model (and with it
+    the same on-disk embedding cache) instead of each loading their own.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[Path, Optional[Path]], BaseEmbedding] = {}
+        self._query_caches: Dict[Tuple[Path, str], QueryEmbeddingCache] = {}
+
+    def embed_model(
+        self, embedding_config_path: Path, cache_dir: Optional[Path] = None
+    ) -> BaseEmbedding:
+        key = (embedding_config_path.resolve(), cache_dir)
+        if key not in self._models:
+            self._models[key] = make_embed_model(embedding_config_path, cache_dir)
+        return self._models[key]
+
+    def query_cache(
+        self, embedding_config_path: Path, store_type: str, config: Dict[str, Any]
+    ) -> QueryEmbeddingCache:
+        """
+        Query cache shared by stores of one type with the same embedding config.
+
+        Store types embed queries differently (local stores use the model's
+        query embedding, Zilliz stores its text embedding), so they don't
+        share caches. The first store's cache settings are used.
+        """
+        key = (embedding_config_path.resolve(), store_type)
+        if key not in self._query_caches:
+            self._query_caches[key] = QueryEmbeddingCache(
+                config.get("query_cache_size", 1024),
+                config.get("query_cache_ttl", 3600),
+            )
+        return self._query_caches[key]
+
+
 class EmbeddingStoreFactory:
     """Factory for creating embedding store instances based on config."""
 
     @staticmethod
-    def create_store(config: Dict[str, Any]) -> EmbeddingStore:
+    def create_store(
+        config: Dict[str, Any], registry: Optional[EmbeddingModelRegistry] = None
+    ) -> EmbeddingStore:
         """
         Create an embedding store instance based on the provided configuration.
 
         Args:
             config: Configuration dictionary with store parameters
+            registry: Registry to share embedding models with other stores
 
         Returns:
             An EmbeddingStore instance
@@ -24,6 +71,19 @@ class EmbeddingStoreFactory:
             ValueError: If the store type is not supported
         """
         store_type = config.get("type", "local")
+        if store_type not in ("local", "zilliz"):
+            raise ValueError(f"Unsupported embedding store type: {store_type}")
+        registry = registry or EmbeddingModelRegistry()
+        embedding_config_path = Path(config.get("embedding_config_path"))
+        embed_model = registry.embed_model(
+            embedding_config_path,
+            (
+                Path(config.get("embedding_cache_dir"))
+                if config.get("embedding_cache_dir")
+                else None
+            ),
+        )
+        query_cache = registry.query_cache(embedding_config_path, store_type, config)
 
         if store_type == "local":
             return LocalEmbeddingStore(
@@ -37,8 +97,20 @@ class EmbeddingStoreFactory:
                 ),
                 allow_update=config.get("allow_update", True),
                 n_results=config.get("n_results", 5),
+                query_cache_size=config.get("query_cache_size", 1024),
+                query_cache_ttl=config.get("query_cache_ttl", 3600),
+                native_search=config.get("native_search", True),
+                faiss_index_config=config.get("faiss_index"),
+                compact_every=config.get("compact_every", 100),
+                compact_interval=config.get("compact_interval", 300),
+                mmap_load=config.get("mmap_load", False),
+                max_document_tokens=config.get("max_document_tokens"),
+                ingest_workers=config.get("ingest_workers", 1),
+                deduplicate_documents=config.get("deduplicate_documents", False),
+                embed_model=embed_model,
+                query_cache=query_cache,
             )
-        elif store_type == "zilliz":
+        else:
             return ZillizEmbeddingStore(
                 embedding_config_path=Path(config.get("embedding_config_path")),
                 uri=config.get("uri"),
@@ -51,6 +123,39 @@ class EmbeddingStoreFactory:
                     if config.get("document_path")
                     else None
                 ),
+                query_cache_size=config.get("query_cache_size", 1024),
+                query_cache_ttl=config.get("query_cache_ttl", 3600),
+                flush_size=config.get("flush_size", 5000),
+                checkpoint_path=(
+                    Path(config.get("checkpoint_path"))
+                    if config.get("checkpoint_path")
+                    else None
+                ),
+                max_document_tokens=config.get("max_document_tokens"),
+                ingest_workers=config.get("ingest_workers", 1),
+                deduplicate_documents=config.get("deduplicate_documents", False),
+                embed_model=embed_model,
+                query_cache=query_cache,
             )
-        else:
-            raise ValueError(f"Unsupported embedding store type: {store_type}")
+
+    @staticmethod
+    def create_stores(config_dir: Path) -> Dict[str, EmbeddingStore]:
+        """
+        Create a store for every retrieval config in a directory.
+
+        Args:
+            config_dir: Directory of retrieval config JSON files
+
+        Returns:
+            Dictionary mapping each config's file name (without .json) to its store
+        """
+        registry = EmbeddingModelRegistry()
+        stores = {}
+        for config_path in sorted(config_dir.glob("*.json")):
+            with open(config_path, "r") as f:
+                config = json.load(f)
+            print(f"Creating store {config_path.stem}")
+            stores[config_path.stem] = EmbeddingStoreFactory.create_store(
+                config, registry
+            )
+        return stores
@@ -0,0 +1,104 @@
+from typing import Any, Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    # HNSW graph degree, and candidate list sizes while building and searching
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    # number of IVF clusters, and how many of them to visit per search
+    "nlist": 1024,
+    "nprobe": 16,
+    # number of PQ sub-quantizers and bits per sub-quantizer code
+    "pq_m": 16,
+    "pq_nbits": 8,
+    # vectors to train IVF indexes on; defaults to 40 per cluster
+    "train_size": None,
+}
+
+
+def resolve_index_config(index_config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fill in defaults for a `faiss_index` retrieval config entry."""
+    config = {**DEFAULT_INDEX_CONFIG, **(index_config or {})}
+    if config["type"] not in INDEX_TYPES:
+        raise ValueError(
+            f"Unsupported FAISS index type {config['type']}, expected one of {INDEX_TYPES}"
+        )
+    if config["train_size"] is None:
+        config["train_size"] = 40 * config["nlist"]
+    return config
+
+
+def make_faiss_index(dimension: int, index_config: Dict[str, Any]) -> faiss.Index:
+    """
+    Create an empty L2 FAISS index of the configured type.
+
+    IVF indexes are returned untrained; see `train_faiss_index`.
+
+    Args:
+        dimension: Dimension of the embedding vectors
+        index_config: Resolved `faiss_index` config
+
+    Returns:
+        The FAISS index
+    """
+    index_type = index_config["type"]
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, index_config["hnsw_m"])
+        index.hnsw.efConstruction = index_config["ef_construction"]
+    else:
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, index_config["nlist"])
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dimension,
+                index_config["nlist"],
+                index_config["pq_m"],
+                index_config["pq_nbits"],
+            )
+    set_search_params(index, index_config)
+    return index
+
+
+def train_faiss_index(index: faiss.Index, vectors: np.ndarray):
+    """
+    Train an index that needs training (IVF) on a sample of vectors.
+
+    Args:
+        index: The untrained index
+        vectors: float32 array of training vectors
+    """
+    ivf = faiss.extract_index_ivf(index)
+    if len(vectors) < ivf.nlist:
+        raise ValueError(
+            f"Need at least {ivf.nlist} vectors to train an index with "
+            f"{ivf.nlist} clusters, got {len(vectors)}; lower nlist or use "
+            f"a flat or hnsw index"
+        )
+    index.train(vectors)
+
+
+def set_search_params(index: faiss.Index, index_config: Dict[str, Any]):
+    """
+    Apply search-time parameters (nprobe, efSearch) to an index.
+
+    These aren't fixed at build time, so they are re-applied whenever an index
+    is loaded and can be tuned without rebuilding.
+
+    Args:
+        index: The FAISS index
+        index_config: Resolved `faiss_index` config
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = index_config["ef_search"]
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = index_config["nprobe"]
@@ -0,0 +1,246 @@
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+import faiss
+import numpy as np
+from llama_index.core import VectorStoreIndex
+
+
+class DocumentTable:
+    """Compact in-memory store of document texts and metadata, addressed by slot."""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def append(self, text: str, metadata: Dict[str, Any]) -> int:
+        """Add a document and return its slot."""
+        self.texts.append(text)
+        self.metadata.append(metadata)
+        return len(self.texts) - 1
+
+    def get(self, slot: int) -> Tuple[str, Dict[str, Any]]:
+        return self.texts[slot], self.metadata[slot]
+
+
+class MmapDocumentTable:
+    """
+    Read-only document table stored on disk and read through mmap.
+
+    Documents are JSON records concatenated in `documents.bin`, with their
+    byte offsets in `document_offsets.npy`. Nothing is read until a document
+    is requested, and processes that open the same files share the page cache.
+    """
+
+    DATA_FILENAME = "documents.bin"
+    OFFSETS_FILENAME = "document_offsets.npy"
+
+    def __init__(self, directory: Path):
+        """
+        Open a document table written by `write`.
+
+        Args:
+            directory: Directory holding the table files
+        """
+        self._offsets = np.load(directory / self.OFFSETS_FILENAME, mmap_mode="r")
+        with open(directory / self.DATA_FILENAME, "rb") as f:
+            # mmap can't map empty files
+            self._data = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(f.fileno()).st_size > 0
+                else b""
+            )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, slot: int) -> Tuple[str, Dict[str, Any]]:
+        record = json.loads(self._data[self._offsets[slot] : self._offsets[slot + 1]])
+        return record["text"], record["metadata"]
+
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (directory / cls.DATA_FILENAME).exists() and (
+            directory / cls.OFFSETS_FILENAME
+        ).exists()
+
+    @classmethod
+    def write(cls, directory: Path, documents: Iterable[Tuple[str, Dict[str, Any]]]):
+        """
+        Write documents to a table in the given directory.
+
+        Args:
+            directory: Directory to write the table files to
+            documents: (text, metadata) pairs, in slot order
+        """
+        offsets = [0]
+        data_path = directory / cls.DATA_FILENAME
+        with open(f"{data_path}.tmp", "wb") as f:
+            for text, metadata in documents:
+                record = json.dumps({"text": text, "metadata": metadata}).encode(
+                    "utf-8"
+                )
+                f.write(record)
+                offsets.append(offsets[-1] + len(record))
+        # write offsets last, so a table is only complete once both files exist
+        offsets_path = directory / cls.OFFSETS_FILENAME
+        os.replace(f"{data_path}.tmp", data_path)
+        with open(f"{offsets_path}.tmp", "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+        os.replace(f"{offsets_path}.tmp", offsets_path)
+
+
+class FaissSearchEngine:
+    """
+    Searches a FAISS index directly, bypassing the llama_index retriever.
+
+    Keeps a numpy map from FAISS row to document slot and a DocumentTable with
+    the text and metadata of every row, so a search is one `faiss.Index.search`
+    call plus array lookups.
+    """
+
+    def __init__(
+        self,
+        faiss_index: faiss.Index,
+        documents: Union[DocumentTable, MmapDocumentTable],
+    ):
+        """
+        Initialize an empty search engine over a FAISS index.
+
+        Args:
+            faiss_index: The index to search; rows are registered with `add`
+            documents: Table holding the document for each registered row
+        """
+        self.faiss_index = faiss_index
+        self.documents = documents
+        self._row_to_slot = np.full(1024, -1, dtype=np.int64)
+        self.n_rows = 0
+
+    @classmethod
+    def from_vector_store_index(cls, index: VectorStoreIndex) -> "FaissSearchEngine":
+        """
+        Build a search engine from a llama_index index backed by FaissVectorStore.
+
+        Args:
+            index: The llama_index index
+
+        Returns:
+            A search engine over the same FAISS index
+        """
+        engine = cls(index.vector_store.client, DocumentTable())
+        engine.sync(index)
+        return engine
+
+    @classmethod
+    def from_document_table(
+        cls, faiss_index: faiss.Index, documents: MmapDocumentTable
+    ) -> "FaissSearchEngine":
+        """
+        Build a search engine over a FAISS index and a table in FAISS row order.
+
+        Args:
+            faiss_index: The FAISS index
+            documents: Table whose slot i holds the document of FAISS row i
+
+        Returns:
+            A search engine over the index
+        """
+        if len(documents) != faiss_index.ntotal:
+            raise ValueError(
+                f"Document table has {len(documents)} entries but the index "
+                f"has {faiss_index.ntotal} vectors"
+            )
+        engine = cls(faiss_index, documents)
+        engine._row_to_slot = np.arange(len(documents), dtype=np.int64)
+        engine.n_rows = len(documents)
+        return engine
+
+    def iter_documents(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield the (text, metadata) of every registered row, in row order."""
+        for row in range(self.n_rows):
+            yield self.documents.get(self._row_to_slot[row])
+
+    def sync(self, index: VectorStoreIndex):
+        """
+        Register FAISS rows that were added to a llama_index index since the last sync.
+
+        Args:
+            index: The llama_index index sharing this engine's FAISS index
+        """
+        new_rows = range(self.n_rows, self.faiss_index.ntotal)
+        if not new_rows:
+            return
+        nodes_dict = index.index_struct.nodes_dict
+        nodes = index.docstore.get_nodes([nodes_dict[str(row)] for row in new_rows])
+        self.add(
+            new_rows, [node.text for node in nodes], [node.metadata for node in nodes]
+        )
+
+    def add(self, rows: range, texts: List[str], metadata: List[Dict[str, Any]]):
+        """
+        Register documents for FAISS rows that were already added to the index.
+
+        Args:
+            rows: FAISS row numbers, continuing on from the rows already registered
+            texts: Text of the document at each row
+            metadata: Metadata of the document at each row
+        """
+        if rows.start != self.n_rows:
+            raise ValueError(
+                f"Expected rows starting at {self.n_rows}, got {rows.start}"
+            )
+        if rows.stop > len(self._row_to_slot):
+            grown = np.full(
+                max(rows.stop, 2 * len(self._row_to_slot)), -1, dtype=np.int64
+            )
+            grown[: self.n_rows] = self._row_to_slot[: self.n_rows]
+            self._row_to_slot = grown
+        for row, text, meta in zip(rows, texts, metadata):
+            self._row_to_slot[row] = self.documents.append(text, meta)
+        self.n_rows = rows.stop
+
+    def search(
+        self, query_embeddings: np.ndarray, ns: List[int]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search the index with a matrix of query embeddings.
+
+        Args:
+            query_embeddings: float32 array of shape (n_queries, vector_dimension)
+            ns: Number of results to return for each query
+
+        Returns:
+            List with the search results for each query, each result a dict
+            with "id", "text", "score" and "metadata" keys
+        """
+        k = max(ns, default=0)
+        if k == 0:
+            return [[] for _ in ns]
+        distances, rows = self.faiss_index.search(query_embeddings, k)
+        all_results = []
+        for query_distances, query_rows, n in zip(distances, rows, ns):
+            results = []
+            for distance, row in zip(query_distances[:n], query_rows[:n]):
+                # FAISS pads with -1 when the index has fewer than k vectors
+                if row < 0:
+                    break
+                # skip rows added to the index but not registered yet
+                if row >= self.n_rows:
+                    continue
+                text, metadata = self.documents.get(self._row_to_slot[row])
+                results.append(
+                    {
+                        "id": len(results),
+                        "text": text,
+                        "score": float(distance),
+                        "metadata": metadata,
+                    }
+                )
+            all_results.append(results)
+        return all_results
@@ -1,9 +1,13 @@
+import asyncio
+import atexit
 import os
 import shutil
+import threading
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 import faiss
+import numpy as np
 from llama_index.core import (
     Document,
     Settings,
@@ -11,11 +15,53 @@ from llama_index.core import (
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode, QueryBundle
+from llama_index.core.storage.storage_context import INDEX_STORE_FNAME
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+from llama_index.core.vector_stores.types import DEFAULT_PERSIST_FNAME
 from llama_index.vector_stores.faiss import FaissVectorStore
 
-from src.retrieval.documents import prep_parquet, prep_txt_document
+from src.retrieval.batching import (
+    aget_query_embedding_batch,
+    embed_in_batches,
+    get_query_embedding_batch,
+)
+from src.retrieval.documents import EmbedDocument, iter_documents
 from src.retrieval.embed_model import make_embed_model
-from src.retrieval.embedding_core import EmbeddingStore
+from src.retrieval.embedding_core import (
+    EmbeddingStore,
+    document_id,
+    resolve_metadata,
+    resolve_n_results,
+)
+from src.retrieval.faiss_index import (
+    make_faiss_index,
+    resolve_index_config,
+    set_search_params,
+    train_faiss_index,
+)
+from src.retrieval.faiss_search import FaissSearchEngine, MmapDocumentTable
+from src.retrieval.micro_batching import micro_batching_stats
+from src.retrieval.query_cache import QueryEmbeddingCache
+from src.retrieval.rwlock import ReadWriteLock
+from src.retrieval.update_log import UpdateLog
+
+UPDATE_LOG_FILENAME = "update_log.jsonl"
+# seconds a read-only store waits for another process to finish replaying the log
+READ_ONLY_LOCK_TIMEOUT = 60.0
+# snapshots are written here in full before being moved into the index directory
+SNAPSHOT_DIRNAME = "snapshot.tmp"
+FAISS_FILENAME = f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"
+
+
+def _fsync_path(path: Path):
+    """Flush a file or directory entry to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class LocalEmbeddingStore(EmbeddingStore):
@@ -29,6 +75,18 @@ class LocalEmbeddingStore(EmbeddingStore):
         document_path: Optional[Path] = None,
         allow_update: bool = True,
         n_results: int = 5,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+        native_search: bool = True,
+        faiss_index_config: Optional[Dict[str, Any]] = None,
+        compact_every: int = 100,
+        compact_interval: float = 300,
+        mmap_load: bool = False,
+        max_document_tokens: Optional[int] = None,
+        ingest_workers: int = 1,
+        deduplicate_documents: bool = False,
+        embed_model: Optional[BaseEmbedding] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
     ):
         """
         Initialize a local embedding store using FAISS.
@@ -40,16 +98,132 @@ class LocalEmbeddingStore(EmbeddingStore):
             document_path: Path to the documents from which to initialize new index
             allow_update: Whether to allow adding new documents
             n_results: Default number of results to return from search
+            query_cache_size: Maximum number of query embeddings to cache
+            query_cache_ttl: Seconds a cached query embedding stays valid
+            native_search: Whether to search FAISS directly instead of through
+                the llama_index retriever
+            faiss_index_config: FAISS index type and tuning parameters, see
+                src/retrieval/faiss_index.py (defaults to a flat index)
+            compact_every: Number of logged updates that triggers a snapshot
+            compact_interval: Seconds between background snapshot checks
+            mmap_load: Whether to serve a read-only store straight from
+                memory-mapped files instead of loading it into RAM
+            max_document_tokens: If set, source documents longer than this many
+                estimated tokens are split before indexing
+            ingest_workers: Number of processes to parse a directory of parquet
+                documents with
+            deduplicate_documents: Whether to normalize source document text
+                and drop empty and duplicate documents before indexing
+            embed_model: Embedding model to use instead of loading one from
+                embedding_config_path, so stores can share a model
+            query_cache: Query embedding cache to use instead of creating one
+                from query_cache_size and query_cache_ttl
         """
         self.index_path = index_path
         self.vector_dimension = vector_dimension
         self.document_path = document_path
+        self.max_document_tokens = max_document_tokens
+        self.ingest_workers = ingest_workers
+        self.deduplicate_documents = deduplicate_documents
         self.allow_update = allow_update
         self.default_n_results = n_results
-        self.embed_model = make_embed_model(embedding_config_path)
-        Settings.embed_model = self.embed_model
-        self.rag_index = self._init_embedding_index()
-        self.rag_module = self.rag_index.as_retriever(similarity_top_k=n_results)
+        self.faiss_index_config = resolve_index_config(faiss_index_config)
+        self.embed_model = embed_model or make_embed_model(embedding_config_path)
+        self.query_cache = query_cache or QueryEmbeddingCache(
+            query_cache_size, query_cache_ttl
+        )
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        # serializes updates with each other and with snapshots
+        self._write_lock = threading.Lock()
+        # searches share the in-memory index; inserting into it is exclusive
+        self._index_lock = ReadWriteLock()
+        self._compact_requested = threading.Event()
+        # the log can hold updates from when the store last allowed them, which
+        # are applied whether or not it allows them now
+        update_log_path = self.index_path / UPDATE_LOG_FILENAME
+        # read-only stores only hold the log while replaying it, so they wait
+        # for each other; a store that allows updates holds it until it closes
+        lock_timeout = 0.0 if allow_update else READ_ONLY_LOCK_TIMEOUT
+        self.update_log = (
+            UpdateLog(update_log_path, lock_timeout)
+            if update_log_path.exists()
+            else None
+        )
+        # memory-mapped files can't be appended to, so only read-only stores use
+        # them, and only once logged updates are part of the snapshot
+        self.mmap_load = mmap_load and not allow_update
+        self.search_engine = (
+            self._load_mmap()
+            if self.mmap_load
+            and (self.update_log is None or self.update_log.n_records == 0)
+            else None
+        )
+        if self.search_engine is not None:
+            self.rag_index = None
+            self.rag_module = None
+        else:
+            self.rag_index = self._init_embedding_index()
+            self.rag_module = self.rag_index.as_retriever(similarity_top_k=n_results)
+            self.search_engine = (
+                FaissSearchEngine.from_vector_store_index(self.rag_index)
+                if native_search or self.mmap_load
+                else None
+            )
+            if self.update_log is None and allow_update:
+                self.update_log = UpdateLog(update_log_path, lock_timeout)
+            if self.update_log is not None:
+                self._replay_update_log()
+                if not allow_update:
+                    # fold the updates into the snapshot, so later read-only
+                    # startups (and memory-mapped ones) include them
+                    self.compact()
+            if self.mmap_load:
+                # write the layout that later startups will memory-map
+                print(f"Writing memory-mappable document table to {self.index_path}")
+                MmapDocumentTable.write(
+                    self.index_path, self.search_engine.iter_documents()
+                )
+        if allow_update:
+            threading.Thread(target=self._compaction_loop, daemon=True).start()
+            # snapshot whatever is still only logged when the process exits
+            atexit.register(self.close)
+        elif self.update_log is not None:
+            self.update_log.close()
+            self.update_log = None
+
+    def _load_mmap(self) -> Optional[FaissSearchEngine]:
+        """
+        Build a search engine over memory-mapped index files, skipping llama_index.
+
+        Returns:
+            The search engine, or None if the files are missing or out of date
+        """
+        faiss_path = self.index_path / FAISS_FILENAME
+        if not (faiss_path.exists() and MmapDocumentTable.exists(self.index_path)):
+            return None
+        print(f"Memory-mapping index from {self.index_path}")
+        try:
+            return FaissSearchEngine.from_document_table(
+                self._read_faiss_index_mmap(str(faiss_path)),
+                MmapDocumentTable(self.index_path),
+            )
+        except ValueError as e:
+            # the index was updated after the table was written
+            print(f"Rebuilding memory-mappable document table: {e}")
+            return None
+
+    def _read_faiss_index_mmap(self, faiss_path: str) -> faiss.Index:
+        """Read the persisted FAISS index, memory-mapping it where FAISS supports it."""
+        try:
+            faiss_index = faiss.read_index(
+                faiss_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+        except RuntimeError as e:
+            print(f"Can't memory-map {faiss_path}, reading it instead: {e}")
+            faiss_index = faiss.read_index(faiss_path)
+        set_search_params(faiss_index, self.faiss_index_config)
+        return faiss_index
 
     def _init_embedding_index(self) -> VectorStoreIndex:
         """Initialize or load the FAISS index."""
@@ -60,31 +234,118 @@ class LocalEmbeddingStore(EmbeddingStore):
             storage_context = StorageContext.from_defaults(
                 vector_store=vector_store, persist_dir=self.index_path
             )
-            index = load_index_from_storage(storage_context=storage_context)
+            # pass the model explicitly rather than through the global Settings,
+            # which would be shared by every store in the process
+            index = load_index_from_storage(
+                storage_context=storage_context, embed_model=self.embed_model
+            )
+            set_search_params(vector_store.client, self.faiss_index_config)
+            self._drop_rows_without_vectors(index)
             return index
         else:
             print(f"Creating index at {self.index_path} from {self.document_path}")
-            faiss_index = faiss.IndexFlatL2(self.vector_dimension)
-            if self.document_path is None:
-                documents = []
-            elif str(self.document_path).endswith(".txt"):
-                documents = prep_txt_document(self.document_path)
-            else:
-                documents = prep_parquet(self.document_path)
+            faiss_index = make_faiss_index(
+                self.vector_dimension, self.faiss_index_config
+            )
+            if not faiss_index.is_trained and self.document_path is None:
+                raise ValueError(
+                    f"{self.faiss_index_config['type']} indexes must be trained on "
+                    "documents; use a flat or hnsw index for stores that start empty"
+                )
+            documents = (
+                iter_documents(
+                    self.document_path,
+                    self.max_document_tokens,
+                    self.ingest_workers,
+                    self.deduplicate_documents,
+                )
+                if self.document_path is not None
+                else []
+            )
 
-            documents = [
-                Document(text=doc.text, metadata=doc.metadata) for doc in documents
-            ]
-            print(f"Embedding {len(documents)} documents...")
             vector_store = FaissVectorStore(faiss_index=faiss_index)
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            index = VectorStoreIndex.from_documents(
-                documents, storage_context=storage_context
+            index = VectorStoreIndex(
+                nodes=[], storage_context=storage_context, embed_model=self.embed_model
             )
+            self._ingest(index, documents)
             index.storage_context.persist(persist_dir=self.index_path)
 
         return index
 
+    def _drop_rows_without_vectors(self, index: VectorStoreIndex):
+        """
+        Forget nodes whose vectors didn't make it into the persisted FAISS index.
+
+        A crash while a snapshot's files are being moved into place can leave
+        a new docstore and index store next to the old FAISS file. The nodes
+        missing from FAISS are still in the update log and are replayed.
+        """
+        nodes_dict = index.index_struct.nodes_dict
+        ntotal = index.vector_store.client.ntotal
+        missing = [row for row in nodes_dict if int(row) >= ntotal]
+        if missing:
+            print(f"Dropping {len(missing)} nodes that have no vectors in the index")
+            for row in missing:
+                del nodes_dict[row]
+
+    def _ingest(self, index: VectorStoreIndex, documents: Iterable[EmbedDocument]):
+        """
+        Embed documents and insert them into the index batch by batch.
+
+        Embedding requests for later batches stay in flight while earlier
+        batches are inserted into the index.
+
+        Args:
+            index: The index to insert into
+            documents: Documents to add, consumed lazily
+        """
+        nodes = (
+            node
+            for document in documents
+            for node in self._make_nodes(document.text, document.metadata)
+        )
+        faiss_index = index.vector_store.client
+        # nodes held back until there are enough to train the index on
+        held_back = []
+        n_nodes = 0
+        for batch, embeddings in embed_in_batches(
+            self.embed_model,
+            nodes,
+            lambda node: node.get_content(metadata_mode=MetadataMode.EMBED),
+        ):
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            if not faiss_index.is_trained:
+                held_back.extend(batch)
+                if len(held_back) < self.faiss_index_config["train_size"]:
+                    continue
+                self._train_index(faiss_index, held_back)
+                batch, held_back = held_back, []
+            index.insert_nodes(batch)
+            n_nodes += len(batch)
+        if held_back:
+            self._train_index(faiss_index, held_back)
+            index.insert_nodes(held_back)
+            n_nodes += len(held_back)
+        print(f"Embedded {n_nodes} nodes")
+
+    def _make_nodes(self, text: str, metadata: Dict[str, Any]) -> List[BaseNode]:
+        """Split a document into nodes the same way llama_index ingestion would."""
+        return Settings.node_parser.get_nodes_from_documents(
+            [Document(text=text, metadata=metadata)]
+        )
+
+    def _train_index(self, faiss_index: faiss.Index, nodes: List[BaseNode]):
+        """Train an index that needs training on the embeddings of the given nodes."""
+        print(
+            f"Training {self.faiss_index_config['type']} index on {len(nodes)} vectors"
+        )
+        train_faiss_index(
+            faiss_index,
+            np.asarray([node.embedding for node in nodes], dtype=np.float32),
+        )
+
     def search(
         self, query: str, n_results: Optional[int] = None
     ) -> List[Dict[str, Any]]:
@@ -99,12 +360,47 @@ class LocalEmbeddingStore(EmbeddingStore):
             List of dictionaries containing search results with text and metadata
         """
         n = n_results if n_results is not None else self.default_n_results
+        query_embedding = self.query_cache.get_or_compute(
+            query, self.embed_model.get_query_embedding
+        )
+        return self._search_embedding(query, query_embedding, n)
+
+    async def asearch(
+        self, query: str, n_results: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of `search`.
+
+        The query is embedded without blocking the event loop, and the index
+        is searched in a worker thread.
+        """
+        n = n_results if n_results is not None else self.default_n_results
+        query_embedding = await self.query_cache.aget_or_compute(
+            query, self.embed_model.aget_query_embedding
+        )
+        return await asyncio.to_thread(
+            self._search_embedding, query, query_embedding, n
+        )
+
+    def _search_embedding(
+        self, query: str, query_embedding: List[float], n: int
+    ) -> List[Dict[str, Any]]:
+        """Search the index with an already embedded query."""
+        if self.search_engine is not None:
+            return self._search_engine_search(
+                np.asarray([query_embedding], dtype=np.float32), [n]
+            )[0]
 
-        # Update retriever if n_results changed
-        if n != self.rag_module._similarity_top_k:
-            self.rag_module = self.rag_index.as_retriever(similarity_top_k=n)
+        # build a retriever for this call rather than replacing the shared one,
+        # which concurrent searches may be using
+        retriever = self.rag_module
+        if n != retriever._similarity_top_k:
+            retriever = self.rag_index.as_retriever(similarity_top_k=n)
 
-        retrieved = self.rag_module.retrieve(query)
+        with self._index_lock.read():
+            retrieved = retriever.retrieve(
+                QueryBundle(query_str=query, embedding=query_embedding)
+            )
 
         # Convert to a more API-friendly format
         results = []
@@ -120,6 +416,70 @@ class LocalEmbeddingStore(EmbeddingStore):
 
         return results
 
+    def _search_engine_search(
+        self, query_embeddings: np.ndarray, ns: List[int]
+    ) -> List[List[Dict[str, Any]]]:
+        """Search with the native engine, holding the index for reading."""
+        with self._index_lock.read():
+            return self.search_engine.search(query_embeddings, ns)
+
+    def search_many(
+        self,
+        queries: List[str],
+        n_results: Optional[Union[int, List[Optional[int]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search for documents similar to each of several queries.
+
+        With native search enabled, uncached queries are embedded together and
+        all queries are searched with a single FAISS call.
+
+        Args:
+            queries: The search queries
+            n_results: Number of results to return, either shared by all
+                queries or given per query (overrides default)
+
+        Returns:
+            List with the search results for each query, in query order
+        """
+        if self.search_engine is None:
+            return super().search_many(queries, n_results)
+        ns = resolve_n_results(len(queries), n_results, self.default_n_results)
+        if not queries:
+            return []
+        query_embeddings = self.query_cache.get_or_compute_many(
+            queries,
+            lambda misses: get_query_embedding_batch(self.embed_model, misses),
+        )
+        return self._search_engine_search(
+            np.asarray(query_embeddings, dtype=np.float32), ns
+        )
+
+    async def asearch_many(
+        self,
+        queries: List[str],
+        n_results: Optional[Union[int, List[Optional[int]]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Async version of `search_many`."""
+        ns = resolve_n_results(len(queries), n_results, self.default_n_results)
+        if self.search_engine is None:
+            return list(
+                await asyncio.gather(
+                    *(self.asearch(query, n) for query, n in zip(queries, ns))
+                )
+            )
+        if not queries:
+            return []
+        query_embeddings = await self.query_cache.aget_or_compute_many(
+            queries,
+            lambda misses: aget_query_embedding_batch(self.embed_model, misses),
+        )
+        return await asyncio.to_thread(
+            self._search_engine_search,
+            np.asarray(query_embeddings, dtype=np.float32),
+            ns,
+        )
+
     def update(self, document: str, metadata: Dict[str, Any] = {}) -> bool:
         """
         Add a new document to the embedding store.
@@ -128,22 +488,196 @@ class LocalEmbeddingStore(EmbeddingStore):
             document: The document text to add
             metadata: Optional metadata for the document
 
+        Returns:
+            Boolean indicating if the update was successful
+        """
+        return self.update_many([document], [metadata])
+
+    async def aupdate(self, document: str, metadata: Dict[str, Any] = {}) -> bool:
+        """Async version of `update`."""
+        return await self.aupdate_many([document], [metadata])
+
+    def update_many(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """
+        Add several documents to the embedding store at once.
+
+        The documents are embedded together and logged and inserted as one
+        update, so either all of them are added or none are.
+
+        Args:
+            documents: The document texts to add
+            metadata: Optional metadata for each document
+
         Returns:
             Boolean indicating if the update was successful
         """
         if not self.allow_update:
             return False
 
-        metadata = metadata or {}
-        node = Document(text=document, metadata=metadata)
+        metadata = resolve_metadata(len(documents), metadata)
+        try:
+            nodes = self._new_nodes(self._make_batch_nodes(documents, metadata))
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            self._add_embedded_nodes(nodes, embeddings)
+            return True
+        except Exception as e:
+            print(f"Error updating documents: {e}")
+            return False
 
+    async def aupdate_many(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """
+        Async version of `update_many`.
+
+        The documents are embedded without blocking the event loop, and added
+        to the index in a worker thread.
+        """
+        if not self.allow_update:
+            return False
+
+        metadata = resolve_metadata(len(documents), metadata)
         try:
-            self.rag_index.insert(node)
-            self.rag_index.storage_context.persist(persist_dir=self.index_path)
+            nodes = self._new_nodes(self._make_batch_nodes(documents, metadata))
+            embeddings = await self.embed_model.aget_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            await asyncio.to_thread(self._add_embedded_nodes, nodes, embeddings)
             return True
         except Exception as e:
+            print(f"Error updating documents: {e}")
             return False
 
+    def _make_batch_nodes(
+        self, documents: List[str], metadata: List[Dict[str, Any]]
+    ) -> List[BaseNode]:
+        """
+        Split each of several documents into nodes.
+
+        Node ids are derived from the document's content, so that sending an
+        update again (say, after a timeout) doesn't add it twice.
+        """
+        nodes = []
+        for document, meta in zip(documents, metadata):
+            doc_id = document_id(document, meta)
+            for i, node in enumerate(self._make_nodes(document, meta)):
+                node.id_ = f"{doc_id}-{i}"
+                nodes.append(node)
+        return nodes
+
+    def _new_nodes(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """Drop nodes that are already in the index or repeated in the list."""
+        docstore = self.rag_index.docstore
+        new_nodes = {}
+        for node in nodes:
+            if node.node_id not in new_nodes and not docstore.document_exists(
+                node.node_id
+            ):
+                new_nodes[node.node_id] = node
+        return list(new_nodes.values())
+
+    def _add_embedded_nodes(self, nodes: List[BaseNode], embeddings: List[List[float]]):
+        """Log nodes and their embeddings, then add them to the index."""
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        with self._write_lock:
+            # a concurrent copy of the same update may have been added meanwhile
+            nodes = self._new_nodes(nodes)
+            if not nodes:
+                return
+            self.update_log.append(nodes)
+            self._insert_nodes(nodes)
+        if self.update_log.n_records >= self.compact_every:
+            self._compact_requested.set()
+
+    def _insert_nodes(self, nodes: List[BaseNode]):
+        """Add nodes with precomputed embeddings to the in-memory index."""
+        # FAISS may reallocate its vectors while adding, so searches wait;
+        # embedding and logging happen before this and don't block them
+        with self._index_lock.write():
+            self.rag_index.insert_nodes(nodes)
+            if self.search_engine is not None:
+                self.search_engine.sync(self.rag_index)
+
+    def _replay_update_log(self):
+        """Re-apply updates logged after the last snapshot was written."""
+        # a crash between writing a snapshot and truncating the log leaves
+        # records that the snapshot already contains; nodes count as indexed
+        # only once they have a FAISS row, since the docstore is written first
+        indexed = set(self.rag_index.index_struct.nodes_dict.values())
+        nodes = [
+            node for node in self.update_log.replay() if node.node_id not in indexed
+        ]
+        if nodes:
+            print(f"Replaying {len(nodes)} logged updates")
+            self._insert_nodes(nodes)
+
+    def compact(self):
+        """Write a full snapshot of the index and truncate the update log."""
+        with self._write_lock:
+            if self.update_log is None or self.update_log.n_records == 0:
+                return
+            # writing a snapshot only reads the index, so searches carry on;
+            # holding _write_lock keeps updates out until the log is truncated
+            with self._index_lock.read():
+                self._write_snapshot()
+            self.update_log.truncate()
+
+    def _write_snapshot(self):
+        """
+        Persist the index without ever leaving a half-written snapshot on disk.
+
+        The files are written and fsync'd in a temporary directory, then moved
+        over the old ones with the FAISS index last. Loading drops nodes that
+        have no FAISS row, so a crash between the moves loses nothing that
+        isn't still in the update log.
+        """
+        snapshot_path = self.index_path / SNAPSHOT_DIRNAME
+        if snapshot_path.exists():
+            shutil.rmtree(snapshot_path)
+        self.rag_index.storage_context.persist(persist_dir=snapshot_path)
+        for path in snapshot_path.iterdir():
+            _fsync_path(path)
+        _fsync_path(snapshot_path)
+        last = [INDEX_STORE_FNAME, FAISS_FILENAME]
+        names = sorted(
+            (path.name for path in snapshot_path.iterdir()),
+            key=lambda name: last.index(name) + 1 if name in last else 0,
+        )
+        for name in names:
+            os.replace(snapshot_path / name, self.index_path / name)
+        _fsync_path(self.index_path)
+        snapshot_path.rmdir()
+
+    def close(self):
+        """Snapshot logged updates and close the update log."""
+        if self.update_log is None:
+            return
+        try:
+            self.compact()
+        finally:
+            with self._write_lock:
+                self.update_log.close()
+                self.update_log = None
+
+    def _compaction_loop(self):
+        """Snapshot periodically, or sooner once enough updates are logged."""
+        while True:
+            self._compact_requested.wait(self.compact_interval)
+            self._compact_requested.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting index: {e}")
+
     def health_check(self) -> Dict[str, Any]:
         """
         Check if the embedding store is available and return status information.
@@ -153,15 +687,25 @@ class LocalEmbeddingStore(EmbeddingStore):
         """
         try:
             # Basic check - try to access the index
-            _ = self.rag_index.storage_context.vector_store
+            if self.rag_index is not None:
+                _ = self.rag_index.storage_context.vector_store
+            else:
+                _ = self.search_engine.faiss_index.ntotal
 
             return {
                 "status": "ok",
                 "type": "local",
                 "index_path": str(self.index_path),
-                "embedding_model": self.embedding_model_name,
+                "embedding_model": self.embed_model.model_name,
                 "allow_update": self.allow_update,
                 "exists": os.path.exists(self.index_path),
+                "faiss_index": self.faiss_index_config["type"],
+                "mmap_load": self.mmap_load,
+                "logged_updates": (
+                    self.update_log.n_records if self.update_log is not None else 0
+                ),
+                "query_cache": self.query_cache.stats(),
+                "embedding_batcher": micro_batching_stats(self.embed_model),
             }
         except Exception as e:
             return {"status": "error", "type": "local", "error": str(e)}
@@ -0,0 +1,193 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.embeddings import BaseEmbedding
+from pydantic import PrivateAttr
+
+from src.retrieval.batching import get_query_embedding_batch
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+def _resolve(set_outcome: Callable[[Any], None], outcome: Any):
+    """Set a request's result or exception without letting a failure stop the worker."""
+    try:
+        set_outcome(outcome)
+    except InvalidStateError as e:
+        print(f"Dropping embedding for a request that was already resolved: {e}")
+
+
+class MicroBatchingEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper that merges concurrent single-text requests.
+
+    Requests for one query or text embedding are queued, and a worker thread
+    collects them for up to `max_wait_ms` (or until `max_batch_size` are
+    waiting) and embeds them with a single forward pass of the wrapped model.
+    This is meant for local models, where a batch of queries costs little
+    more than one. Embedding lists of texts bypasses the queue, since they
+    are already batched.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _max_batch_size: int = PrivateAttr()
+    _max_wait_seconds: float = PrivateAttr()
+    _queue: queue.Queue = PrivateAttr()
+    _worker: threading.Thread = PrivateAttr()
+    _stats_lock: threading.Lock = PrivateAttr()
+    _n_requests: int = PrivateAttr(default=0)
+    _n_batches: int = PrivateAttr(default=0)
+    _n_batched: int = PrivateAttr(default=0)
+    _largest_batch: int = PrivateAttr(default=0)
+    _max_queue_depth: int = PrivateAttr(default=0)
+
+    def __init__(
+        self,
+        inner: BaseEmbedding,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ):
+        """
+        Wrap an embedding model and start the batching worker.
+
+        Args:
+            inner: The model to embed with
+            max_batch_size: Maximum number of requests embedded together
+            max_wait_ms: How long to wait for more requests after the first
+                one in a batch arrives
+        """
+        super().__init__(
+            model_name=inner.model_name, embed_batch_size=inner.embed_batch_size
+        )
+        self._inner = inner
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _submit(self, kind: str, text: str) -> Future:
+        future = Future()
+        self._queue.put((kind, text, future))
+        with self._stats_lock:
+            self._n_requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def _collect(self) -> List[Tuple[str, str, Future]]:
+        """Block for a request, then gather more until the batch is full or time is up."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait_seconds
+        while len(batch) < self._max_batch_size:
+            try:
+                batch.append(
+                    self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # requests whose callers gave up (a cancelled await, say) are
+            # dropped; the rest can no longer be cancelled once running
+            batch = [
+                request
+                for request in self._collect()
+                if request[2].set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self._n_batches += 1
+                self._n_batched += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+            # queries and texts may be embedded with different prompts
+            for kind, embed in (
+                ("query", self._embed_queries),
+                ("text", self._inner.get_text_embedding_batch),
+            ):
+                requests = [request for request in batch if request[0] == kind]
+                if not requests:
+                    continue
+                try:
+                    embeddings = embed([text for _, text, _ in requests])
+                except Exception as e:
+                    for _, _, future in requests:
+                        _resolve(future.set_exception, e)
+                    continue
+                for (_, _, future), embedding in zip(requests, embeddings):
+                    _resolve(future.set_result, embedding)
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        # HuggingFaceEmbedding only embeds queries one at a time, but its
+        # _embed method takes a batch and the query prompt
+        if hasattr(self._inner, "_embed"):
+            return self._inner._embed(queries, prompt_name="query")
+        return get_query_embedding_batch(self._inner, queries)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._submit("query", query).result()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit("query", query))
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return self._embed_queries(queries)
+
+    async def aget_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        # queued together, so they are batched with any other waiting requests
+        return list(
+            await asyncio.gather(
+                *(
+                    asyncio.wrap_future(self._submit("query", query))
+                    for query in queries
+                )
+            )
+        )
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._submit("text", text).result()
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit("text", text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._inner.get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._inner.aget_text_embedding_batch(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self._max_batch_size,
+                "max_wait_ms": self._max_wait_seconds * 1000,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._n_requests,
+                "batches": self._n_batches,
+                "mean_batch_size": (
+                    self._n_batched / self._n_batches if self._n_batches else 0
+                ),
+                "largest_batch": self._largest_batch,
+            }
+
+
+def micro_batching_stats(embed_model: BaseEmbedding) -> Optional[Dict[str, Any]]:
+    """Stats of the MicroBatchingEmbedding in a stack of model wrappers, if any."""
+    while embed_model is not None:
+        if isinstance(embed_model, MicroBatchingEmbedding):
+            return embed_model.stats()
+        embed_model = getattr(embed_model, "inner", None)
+    return None
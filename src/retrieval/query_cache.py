@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class QueryEmbeddingCache:
+    """Thread-safe in-memory LRU cache of query embeddings with a time-to-live."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of query embeddings to keep
+            ttl_seconds: How long an embedding stays valid after it was computed
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # query -> (expiry time, embedding)
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[List[float]]:
+        """Return the cached embedding for a query, or None if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(query)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[query]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, embedding: List[float]):
+        with self._lock:
+            self._entries[query] = (time.monotonic() + self.ttl_seconds, embedding)
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self, query: str, compute: Callable[[str], List[float]]
+    ) -> List[float]:
+        """
+        Return the cached embedding for a query, computing and caching it on a miss.
+
+        The lock isn't held while computing, so slow embedding calls for
+        different queries don't wait on each other.
+
+        Args:
+            query: The query to embed
+            compute: Function that embeds a query
+
+        Returns:
+            The query embedding
+        """
+        embedding = self.get(query)
+        if embedding is None:
+            embedding = compute(query)
+            self.put(query, embedding)
+        return embedding
+
+    def get_or_compute_many(
+        self, queries: List[str], compute_many: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        """
+        Batched version of `get_or_compute`; misses are embedded in one call.
+
+        Args:
+            queries: The queries to embed
+            compute_many: Function that embeds a list of queries
+
+        Returns:
+            List of query embeddings, in query order
+        """
+        embeddings = [self.get(query) for query in queries]
+        misses = list(
+            dict.fromkeys(
+                query
+                for query, embedding in zip(queries, embeddings)
+                if embedding is None
+            )
+        )
+        if misses:
+            computed = dict(zip(misses, compute_many(misses)))
+            for query, embedding in computed.items():
+                self.put(query, embedding)
+            embeddings = [
+                embedding if embedding is not None else computed[query]
+                for query, embedding in zip(queries, embeddings)
+            ]
+        return embeddings
+
+    async def aget_or_compute(
+        self, query: str, acompute: Callable[[str], Awaitable[List[float]]]
+    ) -> List[float]:
+        """Async version of `get_or_compute`."""
+        embedding = self.get(query)
+        if embedding is None:
+            embedding = await acompute(query)
+            self.put(query, embedding)
+        return embedding
+
+    async def aget_or_compute_many(
+        self,
+        queries: List[str],
+        acompute_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ) -> List[List[float]]:
+        """Async version of `get_or_compute_many`."""
+        embeddings = [self.get(query) for query in queries]
+        misses = list(
+            dict.fromkeys(
+                query
+                for query, embedding in zip(queries, embeddings)
+                if embedding is None
+            )
+        )
+        if misses:
+            computed = dict(zip(misses, await acompute_many(misses)))
+            for query, embedding in computed.items():
+                self.put(query, embedding)
+            embeddings = [
+                embedding if embedding is not None else computed[query]
+                for query, embedding in zip(queries, embeddings)
+            ]
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,141 @@
+import base64
+import fcntl
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterator, List
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+
+class UpdateLogInUseError(Exception):
+    pass
+
+
+class UpdateLog:
+    """
+    Append-only write-ahead log of nodes added to an index since its last snapshot.
+
+    Each line holds one node and its embedding, so replaying the log restores
+    updates without embedding anything again. Every append is fsync'd before
+    it returns.
+    """
+
+    def __init__(self, path: Path, lock_timeout: float = 0.0):
+        """
+        Open or create an update log.
+
+        Args:
+            path: Path of the log file
+            lock_timeout: Seconds to wait for another process to close the log
+
+        Raises:
+            UpdateLogInUseError: If another process still has the log open
+                after lock_timeout
+        """
+        self.path = path
+        self._file = open(self.path, "a", encoding="utf-8")
+        # held until the log is closed, so processes opening the same store
+        # don't replay and compact it at the same time
+        deadline = time.monotonic() + lock_timeout
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._file.close()
+                    raise UpdateLogInUseError(
+                        f"{self.path} is open in another process; a store that "
+                        "allows updates can only be loaded by one process at a time"
+                    )
+                time.sleep(0.1)
+        self.n_records = self._recover()
+
+    def _recover(self) -> int:
+        """
+        Cut off a last record that was only partly written before a crash.
+
+        Records appended after it would otherwise continue the torn line, and
+        replaying would stop there and lose them.
+
+        Returns:
+            The number of complete records in the log
+        """
+        n_records = 0
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                n_records += 1
+                valid_end += len(line)
+        size = self.path.stat().st_size
+        if valid_end < size:
+            print(
+                f"Truncating {size - valid_end} bytes of incomplete records "
+                f"from {self.path}"
+            )
+            os.truncate(self.path, valid_end)
+        return n_records
+
+    def append(self, nodes: List[BaseNode]):
+        """
+        Durably append nodes, which must already have their embeddings set.
+
+        Args:
+            nodes: Nodes to log
+        """
+        lines = []
+        for node in nodes:
+            embedding = np.asarray(node.embedding, dtype=np.float32)
+            node_json = doc_to_json(node.model_copy(update={"embedding": None}))
+            record = {
+                "node": node_json,
+                "embedding": base64.b64encode(embedding.tobytes()).decode("ascii"),
+            }
+            lines.append(json.dumps(record) + "\n")
+        self._file.write("".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.n_records += len(nodes)
+
+    def replay(self) -> Iterator[BaseNode]:
+        """
+        Read back logged nodes, with their embeddings, in the order they were added.
+
+        Reading stops at a record that was only partly written before a crash.
+
+        Yields:
+            Logged nodes
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                node = json_to_doc(record["node"])
+                node.embedding = np.frombuffer(
+                    base64.b64decode(record["embedding"]), dtype=np.float32
+                ).tolist()
+                yield node
+
+    def truncate(self):
+        """Drop all records, once they are covered by a full snapshot."""
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.n_records = 0
+
+    def close(self):
+        self._file.close()
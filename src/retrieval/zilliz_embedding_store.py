@@ -1,7 +1,11 @@
-import uuid
+import asyncio
+import itertools
+import json
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
+from llama_index.core.embeddings import BaseEmbedding
 from pymilvus import (
     Collection,
     CollectionSchema,
@@ -12,9 +16,21 @@ from pymilvus import (
 )
 from tqdm import tqdm
 
-from src.retrieval.documents import prep_parquet, prep_txt_document
+from src.retrieval.batching import embed_in_batches
+from src.retrieval.documents import EmbedDocument, iter_documents
 from src.retrieval.embed_model import make_embed_model
-from src.retrieval.embedding_core import EmbeddingStore
+from src.retrieval.embedding_core import (
+    EmbeddingStore,
+    document_id,
+    resolve_metadata,
+)
+from src.retrieval.micro_batching import micro_batching_stats
+from src.retrieval.query_cache import QueryEmbeddingCache
+
+# maximum number of ids in a single existence query
+ID_QUERY_BATCH_SIZE = 1000
+# maximum length in bytes of the text field
+MAX_TEXT_BYTES = 65535
 
 
 class ZillizEmbeddingStore(EmbeddingStore):
@@ -29,6 +45,15 @@ class ZillizEmbeddingStore(EmbeddingStore):
         dimension: int,
         document_path: Optional[Path],
         default_n_results: int = 5,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+        flush_size: int = 5000,
+        checkpoint_path: Optional[Path] = None,
+        max_document_tokens: Optional[int] = None,
+        ingest_workers: int = 1,
+        deduplicate_documents: bool = False,
+        embed_model: Optional[BaseEmbedding] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
     ):
         """
         Initialize Zilliz Cloud connection.
@@ -39,12 +64,38 @@ class ZillizEmbeddingStore(EmbeddingStore):
             collection_name: Name of the collection to use
             dimension: Dimension of the embedding vectors
             default_n_results: Default number of results to return from search
+            query_cache_size: Maximum number of query embeddings to cache
+            query_cache_ttl: Seconds a cached query embedding stays valid
+            flush_size: Number of rows inserted per request when ingesting documents
+            checkpoint_path: File recording ingestion progress, so an interrupted
+                ingestion can resume (defaults to
+                .vector_store/zilliz_checkpoints/<collection_name>.json)
+            max_document_tokens: If set, source documents longer than this many
+                estimated tokens are split before indexing
+            ingest_workers: Number of processes to parse a directory of parquet
+                documents with
+            deduplicate_documents: Whether to normalize source document text
+                and drop empty and duplicate documents before indexing
+            embed_model: Embedding model to use instead of loading one from
+                embedding_config_path, so stores can share a model
+            query_cache: Query embedding cache to use instead of creating one
+                from query_cache_size and query_cache_ttl
         """
         self.collection_name = collection_name
         self.document_path = document_path
+        self.max_document_tokens = max_document_tokens
+        self.ingest_workers = ingest_workers
+        self.deduplicate_documents = deduplicate_documents
         self.dimension = dimension
         self.default_n_results = default_n_results
-        self.embed_model = make_embed_model(embedding_config_path)
+        self.embed_model = embed_model or make_embed_model(embedding_config_path)
+        self.query_cache = query_cache or QueryEmbeddingCache(
+            query_cache_size, query_cache_ttl
+        )
+        self.flush_size = flush_size
+        self.checkpoint_path = checkpoint_path or Path(
+            f".vector_store/zilliz_checkpoints/{collection_name}.json"
+        )
 
         # Connect to Zilliz Cloud
         print(f"Connecting to Zilliz Cloud at {uri}")
@@ -56,6 +107,18 @@ class ZillizEmbeddingStore(EmbeddingStore):
             self._create_collection()
         else:
             self.collection = Collection(collection_name)
+            # a crash right after the collection was created leaves it without
+            # an index, and it can't be loaded until it has one
+            if not self.collection.has_index():
+                self._create_index()
+            checkpoint = self._read_checkpoint()
+            if (
+                checkpoint is not None
+                and not checkpoint["complete"]
+                and self.document_path is not None
+            ):
+                print(f"Resuming ingestion from document {checkpoint['n_documents']}")
+                self._ingest_documents(resume=True)
         self.collection.load()
 
     def _create_collection(self):
@@ -67,7 +130,7 @@ class ZillizEmbeddingStore(EmbeddingStore):
             FieldSchema(
                 name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dimension
             ),
-            FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535),
+            FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=MAX_TEXT_BYTES),
             FieldSchema(name="metadata", dtype=DataType.JSON),
         ]
 
@@ -75,9 +138,18 @@ class ZillizEmbeddingStore(EmbeddingStore):
             fields=fields, description="Document embeddings collection"
         )
 
+        if self.document_path is not None:
+            # a new collection starts a new ingestion, replacing any old checkpoint
+            self._write_checkpoint(0, complete=False)
         self.collection = Collection(name=self.collection_name, schema=schema)
+        self._create_index()
+
+        print(f"document_path: {self.document_path}")
+        if self.document_path is not None:
+            self._ingest_documents(resume=False)
 
-        # Create IVF_FLAT index for vector field
+    def _create_index(self):
+        """Create an IVF_FLAT index for the vector field."""
         index_params = {
             "metric_type": "L2",
             "index_type": "IVF_FLAT",
@@ -86,17 +158,186 @@ class ZillizEmbeddingStore(EmbeddingStore):
         self.collection.create_index(field_name="embedding", index_params=index_params)
         print(f"Created index for collection {self.collection_name}")
 
-        print(f"document_path: {self.document_path}")
-        if self.document_path is not None:
-            # check if text file
-            if self.document_path.suffix == ".txt":
-                documents = prep_txt_document(self.document_path)
-            else:
-                documents = prep_parquet(self.document_path)
-            print(f"Adding {len(documents)} documents to collection")
-            for document in tqdm(documents):
-                self.update(document.text, document.metadata)
-            print(f"Added {len(documents)} documents to collection")
+    def _read_checkpoint(self) -> Optional[Dict[str, Any]]:
+        if not self.checkpoint_path.exists():
+            return None
+        with open(self.checkpoint_path, "r") as f:
+            return json.load(f)
+
+    def _document_settings(self) -> Dict[str, Any]:
+        """Settings a resumed ingestion must share with its checkpoint."""
+        return {
+            "document_path": str(self.document_path),
+            "max_document_tokens": self.max_document_tokens,
+            "deduplicate": self.deduplicate_documents,
+            "flush_size": self.flush_size,
+        }
+
+    def _write_checkpoint(self, n_documents: int, complete: bool):
+        """Atomically record how many source documents have been inserted."""
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "collection_name": self.collection_name,
+                    **self._document_settings(),
+                    "n_documents": n_documents,
+                    "complete": complete,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _ingest_documents(self, resume: bool):
+        """
+        Bulk insert the documents at document_path.
+
+        Args:
+            resume: Whether to continue an interrupted ingestion from the checkpoint
+        """
+        checkpoint = self._read_checkpoint() if resume else None
+        if checkpoint is not None:
+            # document counts only line up if documents are read and flushed
+            # the same way
+            for name, value in self._document_settings().items():
+                if checkpoint.get(name) != value:
+                    raise ValueError(
+                        f"Checkpoint {self.checkpoint_path} was written with "
+                        f"{name}={checkpoint.get(name)}, not {value}"
+                    )
+        start = checkpoint["n_documents"] if checkpoint is not None else 0
+        print(f"Adding documents from {self.document_path}, starting at {start}")
+        self._write_checkpoint(start, complete=False)
+        n_done = self.bulk_insert(
+            itertools.islice(
+                iter_documents(
+                    self.document_path,
+                    self.max_document_tokens,
+                    self.ingest_workers,
+                    self.deduplicate_documents,
+                ),
+                start,
+                None,
+            ),
+            on_flush=lambda n: self._write_checkpoint(start + n, complete=False),
+        )
+        self._write_checkpoint(start + n_done, complete=True)
+        print(f"Added {n_done} documents to collection")
+
+    def bulk_insert(
+        self,
+        documents: Iterable[EmbedDocument],
+        on_flush: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        Embed documents in batches and insert them in columnar batches of flush_size rows.
+
+        Rows get deterministic ids, so documents that are already in the
+        collection, from an interrupted ingestion or an earlier window of
+        this one, are skipped without embedding them again. Milvus doesn't
+        enforce unique primary keys, so they would otherwise be duplicated.
+
+        Documents too long for the text field are skipped. If inserting a
+        window fails, its rows are inserted one at a time and the ones that
+        fail are skipped, so one bad row can't stop the whole ingestion.
+
+        Args:
+            documents: Documents to insert, consumed lazily
+            on_flush: Optional callback called with the number of documents
+                processed so far after each insert
+
+        Returns:
+            Number of documents processed
+        """
+        documents = iter(documents)
+        n_done = 0
+        with tqdm() as progress:
+            while True:
+                window = list(itertools.islice(documents, self.flush_size))
+                if not window:
+                    break
+                # identical documents would otherwise get duplicate primary keys
+                rows = {
+                    document_id(document.text, document.metadata): document
+                    for document in window
+                }
+                for existing_id in self._existing_ids(list(rows)):
+                    del rows[existing_id]
+                for row_id, document in list(rows.items()):
+                    if len(document.text.encode("utf-8")) > MAX_TEXT_BYTES:
+                        print(
+                            f"Skipping document {row_id}: its text is longer than "
+                            f"{MAX_TEXT_BYTES} bytes; set max_document_tokens to "
+                            "split long documents"
+                        )
+                        del rows[row_id]
+                ids, embeddings, texts, metadata = [], [], [], []
+                for batch, batch_embeddings in embed_in_batches(
+                    self.embed_model,
+                    list(rows.items()),
+                    lambda row: row[1].text,
+                ):
+                    for (row_id, document), embedding in zip(batch, batch_embeddings):
+                        ids.append(row_id)
+                        embeddings.append(embedding)
+                        texts.append(document.text)
+                        metadata.append(document.metadata)
+                if ids:
+                    self._insert_window(ids, embeddings, texts, metadata)
+                n_done += len(window)
+                progress.update(len(window))
+                if on_flush is not None:
+                    on_flush(n_done)
+        self.collection.flush()
+        return n_done
+
+    def _insert_window(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        texts: List[str],
+        metadata: List[Dict[str, Any]],
+    ):
+        """Insert a window of rows, falling back to one row at a time if that fails."""
+        try:
+            self.collection.insert([ids, embeddings, texts, metadata])
+            return
+        except Exception as e:
+            print(f"Error inserting {len(ids)} rows, inserting them one by one: {e}")
+        for row in zip(ids, embeddings, texts, metadata):
+            try:
+                # upsert, in case the failed insert was partly applied
+                self.collection.upsert(
+                    dict(zip(("id", "embedding", "text", "metadata"), row))
+                )
+            except Exception as e:
+                print(f"Skipping document {row[0]}: {e}")
+
+    def _existing_ids(self, ids: List[str]) -> List[str]:
+        """Return the ids that are already in the collection."""
+        existing = []
+        for start in range(0, len(ids), ID_QUERY_BATCH_SIZE):
+            chunk = ids[start : start + ID_QUERY_BATCH_SIZE]
+            # strong consistency sees rows inserted by earlier windows
+            results = self.collection.query(
+                expr=f"id in {json.dumps(chunk)}",
+                output_fields=["id"],
+                consistency_level="Strong",
+            )
+            existing.extend(result["id"] for result in results)
+        return existing
+
+    def _make_row(
+        self, document: str, metadata: Dict[str, Any], embedding: List[float]
+    ) -> Dict[str, Any]:
+        """Build a collection row for a document and its embedding."""
+        return {
+            "id": document_id(document, metadata),
+            "embedding": embedding,
+            "text": document,
+            "metadata": metadata,
+        }
 
     def search(
         self, query: str, n_results: Optional[int] = None
@@ -114,8 +355,30 @@ class ZillizEmbeddingStore(EmbeddingStore):
         n = n_results if n_results is not None else self.default_n_results
 
         # Generate embedding for query
-        query_embedding = self.embed_model.get_text_embedding(query)
+        query_embedding = self.query_cache.get_or_compute(
+            query, self.embed_model.get_text_embedding
+        )
+        return self._search_embedding(query_embedding, n)
+
+    async def asearch(
+        self, query: str, n_results: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of `search`.
+
+        The query is embedded without blocking the event loop, and the
+        collection is searched in a worker thread.
+        """
+        n = n_results if n_results is not None else self.default_n_results
+        query_embedding = await self.query_cache.aget_or_compute(
+            query, self.embed_model.aget_text_embedding
+        )
+        return await asyncio.to_thread(self._search_embedding, query_embedding, n)
 
+    def _search_embedding(
+        self, query_embedding: List[float], n: int
+    ) -> List[Dict[str, Any]]:
+        """Search the collection with an already embedded query."""
         # Search parameters
         search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
 
@@ -158,21 +421,49 @@ class ZillizEmbeddingStore(EmbeddingStore):
             embedding = self.embed_model.get_text_embedding(document)
 
             # Prepare data
-            data = {
-                "id": str(uuid.uuid4()),
-                "embedding": embedding,
-                "text": document,
-                "metadata": metadata,
-            }
+            data = self._make_row(document, metadata, embedding)
 
-            # Insert into collection
-            self.collection.insert(data)
+            # upserting by content id keeps a document that is added twice,
+            # or in bulk and then as an update, from being duplicated
+            self.collection.upsert(data)
             return True
 
         except Exception as e:
             print(f"Error updating document: {e}")
             return False
 
+    def update_many(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """
+        Add several documents to the embedding store with one insert.
+
+        Args:
+            documents: The document texts to add
+            metadata: Optional metadata for each document
+
+        Returns:
+            Boolean indicating if the update was successful
+        """
+        metadata = resolve_metadata(len(documents), metadata)
+        try:
+            embeddings = self.embed_model.get_text_embedding_batch(documents)
+            self.collection.upsert(
+                [
+                    self._make_row(document, meta, embedding)
+                    for document, meta, embedding in zip(
+                        documents, metadata, embeddings
+                    )
+                ]
+            )
+            return True
+
+        except Exception as e:
+            print(f"Error updating documents: {e}")
+            return False
+
     def health_check(self) -> Dict[str, Any]:
         """
         Check if the embedding store is available and return status information.
@@ -188,6 +479,8 @@ class ZillizEmbeddingStore(EmbeddingStore):
                 "collection_name": self.collection_name,
                 "row_count": stats["row_count"],
                 "index_type": "IVF_FLAT",
+                "query_cache": self.query_cache.stats(),
+                "embedding_batcher": micro_batching_stats(self.embed_model),
             }
         except Exception as e:
             return {"status": "error", "type": "zilliz", "error": str(e)}
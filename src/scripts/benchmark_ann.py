@@ -0,0 +1,145 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+from src.retrieval.faiss_index import (
+    make_faiss_index,
+    resolve_index_config,
+    set_search_params,
+    train_faiss_index,
+)
+
+
+def load_store_vectors(config_path: str) -> np.ndarray:
+    """Read every vector out of a persisted local store's FAISS index."""
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    faiss_index = FaissVectorStore.from_persist_dir(config["index_path"]).client
+    return faiss_index.reconstruct_n(0, faiss_index.ntotal)
+
+
+def make_synthetic_vectors(n: int, dimension: int, seed: int) -> np.ndarray:
+    """Clustered random vectors, which are closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((100, dimension), dtype=np.float32)
+    assignments = rng.integers(0, len(centers), n)
+    return centers[assignments] + 0.5 * rng.standard_normal(
+        (n, dimension), dtype=np.float32
+    )
+
+
+def default_sweeps(n: int, dimension: int) -> List[Tuple[Dict[str, Any], List[int]]]:
+    """Index configs to compare, each with the search parameter values to try."""
+    nlist = max(1, min(int(4 * np.sqrt(n)), n // 40))
+    pq_m = next(m for m in (16, 8, 4, 2, 1) if dimension % m == 0)
+    return [
+        ({"type": "hnsw"}, [16, 32, 64, 128, 256]),
+        ({"type": "ivf_flat", "nlist": nlist}, [1, 4, 16, 64]),
+        ({"type": "ivf_pq", "nlist": nlist, "pq_m": pq_m}, [1, 4, 16, 64]),
+    ]
+
+
+def time_searches(
+    index: faiss.Index, queries: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Search one query at a time, returning result rows and latencies in ms."""
+    rows = []
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, query_rows = index.search(queries[i : i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rows.append(query_rows[0])
+    return np.array(rows), np.array(latencies)
+
+
+def recall_at_k(rows: np.ndarray, exact_rows: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(r, e)) for r, e in zip(rows, exact_rows))
+    return hits / exact_rows.size
+
+
+def report(name: str, recall: float, latencies: np.ndarray, build_seconds: float):
+    print(
+        f"{name:<36} recall {recall:.3f}  "
+        f"p50 {np.percentile(latencies, 50):7.3f} ms  "
+        f"p99 {np.percentile(latencies, 99):7.3f} ms  "
+        f"build {build_seconds:7.1f} s"
+    )
+
+
+def benchmark(vectors: np.ndarray, n_queries: int, k: int, seed: int):
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    queries = np.ascontiguousarray(vectors[order[:n_queries]])
+    base = np.ascontiguousarray(vectors[order[n_queries:]])
+    n, dimension = base.shape
+    print(f"{n} vectors of dimension {dimension}, {len(queries)} queries, k={k}")
+
+    start = time.perf_counter()
+    flat = make_faiss_index(dimension, resolve_index_config({"type": "flat"}))
+    flat.add(base)
+    build_seconds = time.perf_counter() - start
+    exact_rows, latencies = time_searches(flat, queries, k)
+    report("flat", 1.0, latencies, build_seconds)
+
+    for index_config, search_values in default_sweeps(n, dimension):
+        index_config = resolve_index_config(index_config)
+        start = time.perf_counter()
+        index = make_faiss_index(dimension, index_config)
+        if not index.is_trained:
+            sample = base[rng.permutation(n)[: index_config["train_size"]]]
+            train_faiss_index(index, sample)
+        index.add(base)
+        build_seconds = time.perf_counter() - start
+        param = "ef_search" if index_config["type"] == "hnsw" else "nprobe"
+        for value in search_values:
+            set_search_params(index, {**index_config, param: value})
+            rows, latencies = time_searches(index, queries, k)
+            name = f"{index_config['type']} {param}={value}"
+            if index_config["type"] != "hnsw":
+                name += f" nlist={index_config['nlist']}"
+            report(name, recall_at_k(rows, exact_rows), latencies, build_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare recall@k and latency of FAISS index types against a flat index"
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="Retrieval config of a persisted local store to take vectors from",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=None,
+        help="Benchmark on this many synthetic vectors instead of a store",
+    )
+    parser.add_argument(
+        "--dimension", type=int, default=512, help="Dimension of synthetic vectors"
+    )
+    parser.add_argument(
+        "--n_queries", type=int, default=1000, help="Number of held-out queries"
+    )
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbours")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    if args.synthetic:
+        vectors = make_synthetic_vectors(args.synthetic, args.dimension, args.seed)
+    elif args.config:
+        vectors = load_store_vectors(args.config)
+    else:
+        parser.error("Either --config or --synthetic is required")
+    benchmark(vectors, args.n_queries, args.k, args.seed)
+
+
+if __name__ == "__main__":
+    main()
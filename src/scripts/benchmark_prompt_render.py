@@ -0,0 +1,130 @@
+import argparse
+import datetime
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from jinja2 import Template
+
+from src.bot.conv_history import ConvHistory
+from src.bot.conversation_prompt_formatter import (
+    ConversationPromptFormatter,
+    load_template,
+)
+from src.bot.message import Message
+from src.utils.benchmark import report, time_calls
+from src.utils.local_logger import LocalLogger
+
+
+def make_message(i: int) -> Message:
+    return Message(
+        conversation="benchmark",
+        timestamp=datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i),
+        sender_name="Zef" if i % 2 else "Konst",
+        platform="benchmark",
+        text_content=f"message number {i}, with a bit of text to make it realistic",
+        bot_config={},
+    )
+
+
+def make_history(n_messages: int, logger: LocalLogger) -> ConvHistory:
+    # long enough that nothing is trimmed
+    conv_history = ConvHistory(True, 10**9, 10**9, None, logger, False, "benchmark")
+    for i in range(n_messages):
+        conv_history.add(make_message(i))
+    return conv_history
+
+
+def benchmark(
+    template_path: Path, history_lengths: List[int], n_calls: int, n_warmup: int
+):
+    logger = LocalLogger(Path("logs/benchmark"), "benchmark", "WARNING", "WARNING")
+    source = template_path.read_text()
+    print(f"Template loading ({template_path})")
+    report(
+        "compile from source",
+        time_calls(lambda i: Template(source), n_calls, n_warmup),
+        width=22,
+    )
+    report(
+        "shared template",
+        time_calls(lambda i: load_template(template_path), n_calls, n_warmup),
+        width=22,
+    )
+
+    formatter = ConversationPromptFormatter(template_path)
+    gt_results = ["a writing sample"] * 5
+    conversation_results = ["a conversation excerpt"] * 5
+
+    def render(conv_history: str):
+        return formatter.make_query(
+            "Zef",
+            "Konst",
+            conv_history,
+            gt_results,
+            conversation_results,
+            True,
+            "benchmark",
+            None,
+        )
+
+    for n_messages in history_lengths:
+        print(f"History of {n_messages} messages")
+        conv_history = make_history(n_messages, logger)
+        # rendering every message on every call, as the history used to be
+        report(
+            "full render",
+            time_calls(
+                lambda i: render(
+                    "\n".join(
+                        message.rag_string(include_timestamp=True)
+                        for message in conv_history.history
+                    )
+                ),
+                n_calls,
+                n_warmup,
+            ),
+            width=22,
+        )
+
+        # a new message arrives before each render, as in a conversation
+        def add_and_render(i: int):
+            conv_history.add(make_message(n_messages + i))
+            render(conv_history)
+
+        report(
+            "incremental render",
+            time_calls(add_and_render, n_calls, n_warmup),
+            width=22,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure prompt render time as the conversation history grows"
+    )
+    parser.add_argument(
+        "--template",
+        type=Path,
+        default=Path("configs/prompt_templates/zef_completion.j2"),
+        help="Path to the prompt template",
+    )
+    parser.add_argument(
+        "--history_lengths",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="Numbers of messages in the history to time rendering at",
+    )
+    parser.add_argument(
+        "--n_calls", type=int, default=200, help="Number of renders to time"
+    )
+    parser.add_argument(
+        "--n_warmup", type=int, default=10, help="Untimed renders to run first"
+    )
+    args = parser.parse_args()
+    benchmark(args.template, args.history_lengths, args.n_calls, args.n_warmup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import random
+from typing import List
+
+import numpy as np
+from llama_index.core.schema import QueryBundle
+
+from src.retrieval.batching import get_query_embedding_batch
+from src.retrieval.embedding_factory import EmbeddingStoreFactory
+from src.retrieval.faiss_search import FaissSearchEngine
+from src.retrieval.local_embedding_store import LocalEmbeddingStore
+from src.utils.benchmark import report, time_calls
+
+
+def benchmark(
+    config_path: str, n_queries: int, n_results: int, n_warmup: int, seed: int
+):
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    store = EmbeddingStoreFactory.create_store(config)
+    if not isinstance(store, LocalEmbeddingStore):
+        raise ValueError("Search benchmark only supports local stores")
+
+    # use stored documents as queries, embedded up front so that only search is timed
+    engine = FaissSearchEngine.from_vector_store_index(store.rag_index)
+    if engine.n_rows == 0:
+        raise ValueError("Index is empty")
+    random.seed(seed)
+    queries: List[str] = [
+        engine.documents.texts[random.randrange(len(engine.documents))]
+        for _ in range(n_queries)
+    ]
+    query_embeddings = np.asarray(
+        get_query_embedding_batch(store.embed_model, queries), dtype=np.float32
+    )
+    print(
+        f"Benchmarking {n_queries} searches for top {n_results} "
+        f"over {engine.n_rows} vectors"
+    )
+
+    retriever = store.rag_index.as_retriever(similarity_top_k=n_results)
+    report(
+        "llama_index",
+        time_calls(
+            lambda i: retriever.retrieve(
+                QueryBundle(query_str=queries[i], embedding=list(query_embeddings[i]))
+            ),
+            n_queries,
+            n_warmup,
+        ),
+        unit="searches",
+    )
+    report(
+        "native",
+        time_calls(
+            lambda i: engine.search(query_embeddings[i : i + 1], [n_results]),
+            n_queries,
+            n_warmup,
+        ),
+        unit="searches",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare llama_index and native FAISS search latency"
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/retrieval/zef_demo_gt.json",
+        help="Path to the retrieval configuration file",
+    )
+    parser.add_argument(
+        "--n_queries", type=int, default=1000, help="Number of searches to time"
+    )
+    parser.add_argument(
+        "--n_results", type=int, default=5, help="Number of results per search"
+    )
+    parser.add_argument(
+        "--n_warmup", type=int, default=50, help="Untimed searches to run first"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    benchmark(args.config, args.n_queries, args.n_results, args.n_warmup, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ async def chat_loop(
     bot_config_path: Path,
     database_config_path: Optional[Path],
     show_prompt: bool,
+    stream: bool,
     logger: LocalLogger,
 ):
     controller = ChatController(bot_config_path, logger)
@@ -31,6 +32,7 @@ async def chat_loop(
         query = input("> ")
         if query == "exit":
             controller.emergency_save()
+            await controller.aclose()
             break
         message = Message(
             conversation="commandline_conversation",
@@ -43,7 +45,18 @@ async def chat_loop(
         if database:
             database.store_message(message)
         controller.update_conv_history(message)
-        prompt, responses = await controller.make_response(message)
+        printed = ""
+
+        async def print_partial(text: str):
+            nonlocal printed
+            print(text[len(printed) :], end="", flush=True)
+            printed = text
+
+        prompt, responses = await controller.make_response(
+            message, print_partial if stream else None
+        )
+        if printed:
+            print()
         if show_prompt:
             print("------------------")
             print("PROMPT:")
@@ -79,7 +92,8 @@ async def chat_loop(
                 controller.update_conv_history(message)
                 if database:
                     database.store_message(message)
-            print(text_content)
+            if not printed:
+                print(text_content)
 
 
 def main():
@@ -87,6 +101,11 @@ def main():
     parser.add_argument(
         "--show_prompt", "-s", action="store_true", help="Print the system prompt"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print responses as they are generated (ignored with tool use)",
+    )
     parser.add_argument(
         "--bot_config_path",
         "-b",
@@ -131,6 +150,7 @@ def main():
             args.bot_config_path,
             args.database_config_path,
             args.show_prompt,
+            args.stream,
             logger,
         )
     )
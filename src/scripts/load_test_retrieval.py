@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import random
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+import numpy as np
+
+from src.retrieval.documents import iter_txt_documents
+
+
+async def run_load(
+    url: str,
+    queries: List[str],
+    n_requests: int,
+    concurrency: int,
+    n_results: int,
+    timeout: float,
+):
+    """Send searches from `concurrency` concurrent clients and report throughput."""
+    latencies = []
+    n_errors = 0
+    next_request = 0
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal n_errors, next_request
+        while next_request < n_requests:
+            query = queries[next_request % len(queries)]
+            next_request += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    f"{url}/api/search",
+                    json={"query": query, "n_results": n_results},
+                )
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+            except httpx.HTTPError as e:
+                n_errors += 1
+                print(f"Request failed: {e}")
+
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(latencies)} searches in {elapsed:.2f}s with {concurrency} "
+        f"concurrent clients, {n_errors} errors"
+    )
+    if latencies:
+        latencies = np.array(latencies)
+        print(
+            f"QPS {len(latencies) / elapsed:.1f}, "
+            f"p50 {np.percentile(latencies, 50):.1f} ms, "
+            f"p90 {np.percentile(latencies, 90):.1f} ms, "
+            f"p99 {np.percentile(latencies, 99):.1f} ms, "
+            f"max {latencies.max():.1f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test a retrieval server's search endpoint"
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="http://localhost:5000",
+        help="Base URL of the retrieval server",
+    )
+    parser.add_argument(
+        "--queries",
+        type=Path,
+        default="data/zef.txt",
+        help="Text document whose chunks are used as queries",
+    )
+    parser.add_argument(
+        "--n_requests", type=int, default=1000, help="Total number of searches"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Number of concurrent clients"
+    )
+    parser.add_argument(
+        "--n_results", type=int, default=5, help="Number of results per search"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="Request timeout in seconds"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    queries = [
+        document.text[:500]
+        for document in iter_txt_documents(args.queries)
+        if document.text.strip()
+    ]
+    random.seed(args.seed)
+    random.shuffle(queries)
+    asyncio.run(
+        run_load(
+            args.url,
+            queries,
+            args.n_requests,
+            args.concurrency,
+            args.n_results,
+            args.timeout,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import argparse
+import asyncio
 import json
 import os
-import time
 from pathlib import Path
 from typing import List, Tuple
 
@@ -69,7 +69,7 @@ def make_output_tsv(
     return "\n".join(lines)
 
 
-def make_answer_file(
+async def make_answer_file(
     gt_tsv_file: Path,
     config_path: Path,
     out_dir: Path,
@@ -100,13 +100,13 @@ def make_answer_file(
             bot_config={},
         )
         controller.update_conv_history(message)
-        prompt, responses = controller.make_response(message)
+        prompt, responses = await controller.make_response(message)
         if show_prompt:
             print("prompt:", prompt)
         print("question:", question)
         print("responses:", responses)
         qa_responses.append(responses)
-        time.sleep(sleep_time)
+        await asyncio.sleep(sleep_time)
     out_fname = os.path.join(out_dir, f"{config_path.stem}.tsv")
     if output_format == "tsv":
         content = make_output_tsv(
@@ -194,14 +194,16 @@ def main():
     logger = LocalLogger(
         args.log_dir, "qa_eval", args.console_log_level, args.file_log_level
     )
-    make_answer_file(
-        args.gt_tsv_file,
-        args.config_path,
-        args.out_dir,
-        logger,
-        args.show_prompt,
-        args.sleep_time,
-        args.output_format,
+    asyncio.run(
+        make_answer_file(
+            args.gt_tsv_file,
+            args.config_path,
+            args.out_dir,
+            logger,
+            args.show_prompt,
+            args.sleep_time,
+            args.output_format,
+        )
     )
 
 
@@ -15,6 +15,7 @@ async def run_bot(discord_bot):
         print("Exiting...")
         await discord_bot.close()  # Properly close Discord connection
         discord_bot.chat_controller.emergency_save()
+        await discord_bot.chat_controller.aclose()
 
 
 def main():
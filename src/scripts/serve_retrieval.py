@@ -1,9 +1,47 @@
 import argparse
+import json
+import os
 from pathlib import Path
+from typing import Optional
 
 from src.retrieval.api import create_flask_app
+from src.retrieval.asgi_api import create_asgi_app
 from src.utils.local_logger import LocalLogger
 
+# passes server settings to ASGI worker processes, which each build their own app
+SERVER_ARGS_ENV = "RETRIEVAL_SERVER_ARGS"
+
+
+def make_logger(log_dir: Path, console_log_level: str, file_log_level: str):
+    return LocalLogger(log_dir, "retrieval_server", console_log_level, file_log_level)
+
+
+def asgi_app_factory():
+    """Build the ASGI app in a uvicorn worker from the settings in the environment."""
+    args = json.loads(os.environ[SERVER_ARGS_ENV])
+    logger = make_logger(
+        Path(args["log_dir"]), args["console_log_level"], args["file_log_level"]
+    )
+    return create_asgi_app(args["config"], logger, args["config_dir"])
+
+
+def check_workers(config_path: str, config_dir: Optional[str], workers: int):
+    """Refuse to serve a writable local store from several processes."""
+    if workers == 1:
+        return
+    config_paths = (
+        sorted(Path(config_dir).glob("*.json")) if config_dir else [config_path]
+    )
+    for path in config_paths:
+        with open(path, "r") as f:
+            config = json.load(f)
+        # each worker would hold its own copy of the index and its own update log
+        if config.get("type", "local") == "local" and config.get("allow_update", True):
+            raise ValueError(
+                f"{path} is a local store that allows updates, which can only be "
+                "served by one worker; set allow_update to false or use --workers 1"
+            )
+
 
 def main():
     """Main entry point for the application."""
@@ -14,6 +52,13 @@ def main():
         default="configs/retrieval/zef.json",
         help="Path to the configuration file",
     )
+    parser.add_argument(
+        "--config_dir",
+        type=str,
+        default=None,
+        help="Directory of configuration files to serve from one process, "
+        "as /api/<config file name>/... (overrides --config)",
+    )
     parser.add_argument(
         "--port", type=int, default=5000, help="Port to run the server on"
     )
@@ -21,6 +66,20 @@ def main():
         "--host", type=str, default="0.0.0.0", help="Host to run the server on"
     )
     parser.add_argument("--debug", action="store_true", help="Run in debug mode")
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["flask", "asgi"],
+        default="flask",
+        help="Serve with Flask's development server, or with uvicorn, "
+        "handling requests concurrently",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes (asgi mode only)",
+    )
     parser.add_argument(
         "--log_dir",
         type=Path,
@@ -41,11 +100,39 @@ def main():
     )
 
     args = parser.parse_args()
-    logger = LocalLogger(
-        args.log_dir, "retrieval_server", args.console_log_level, args.file_log_level
+    if args.mode == "flask":
+        if args.workers != 1:
+            parser.error("--workers requires --mode asgi")
+        logger = make_logger(args.log_dir, args.console_log_level, args.file_log_level)
+        app = create_flask_app(args.config, logger, args.config_dir)
+        # the reloader would load the stores again in a child process while
+        # this one still holds their update logs
+        app.run(debug=args.debug, host=args.host, port=args.port, use_reloader=False)
+        return
+
+    import uvicorn
+
+    try:
+        check_workers(args.config, args.config_dir, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    os.environ[SERVER_ARGS_ENV] = json.dumps(
+        {
+            "config": args.config,
+            "config_dir": args.config_dir,
+            "log_dir": str(args.log_dir),
+            "console_log_level": args.console_log_level,
+            "file_log_level": args.file_log_level,
+        }
+    )
+    uvicorn.run(
+        "src.scripts.serve_retrieval:asgi_app_factory",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level="debug" if args.debug else "info",
     )
-    app = create_flask_app(args.config, logger)
-    app.run(debug=args.debug, host=args.host, port=args.port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+import time
+from typing import Callable
+
+import numpy as np
+
+
+def time_calls(fn: Callable[[int], object], n_calls: int, n_warmup: int) -> np.ndarray:
+    """Call fn(i) for each call index and return per-call latencies in ms."""
+    for i in range(min(n_warmup, n_calls)):
+        fn(i)
+    latencies = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def report(name: str, latencies: np.ndarray, unit: str = "calls", width: int = 10):
+    print(
+        f"{name:>{width}}: p50 {np.percentile(latencies, 50):.3f} ms, "
+        f"p99 {np.percentile(latencies, 99):.3f} ms, "
+        f"mean {latencies.mean():.3f} ms over {len(latencies)} {unit}"
+    )
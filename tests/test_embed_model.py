@@ -0,0 +1,112 @@
+import asyncio
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest
+
+from src.retrieval.embed_model import RemoteEmbeddingModel
+
+
+def fake_embedding(text: str) -> List[float]:
+    # texts are "text <i>", so each embedding identifies its text
+    return [float(text.split()[-1]), float(len(text))]
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    """OpenAI-style embeddings endpoint that returns its data entries out of order."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        data = [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+            for i, text in enumerate(body["input"])
+        ]
+        random.shuffle(data)
+        response = json.dumps({"object": "list", "data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def embeddings_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingsHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_model(server, batch_size: int, max_batch_tokens: int = 100000):
+    return RemoteEmbeddingModel(
+        "fake-model",
+        f"http://127.0.0.1:{server.server_port}/v1/embeddings",
+        "fake-key",
+        {},
+        batch_size=batch_size,
+        max_batch_tokens=max_batch_tokens,
+    )
+
+
+def make_texts(n_texts: int) -> List[str]:
+    return [f"text {i}" for i in range(n_texts)]
+
+
+def request_sizes(server) -> List[int]:
+    return sorted((len(body["input"]) for body in server.requests), reverse=True)
+
+
+def test_batches_split_at_batch_size(embeddings_server):
+    model = make_model(embeddings_server, batch_size=4)
+    texts = make_texts(10)
+
+    embeddings = model.get_text_embedding_batch(texts)
+
+    assert embeddings == [fake_embedding(text) for text in texts]
+    assert request_sizes(embeddings_server) == [4, 4, 2]
+    # every text is sent exactly once
+    sent = [text for body in embeddings_server.requests for text in body["input"]]
+    assert sorted(sent) == sorted(texts)
+
+
+def test_batches_split_at_max_batch_tokens(embeddings_server):
+    # "text <i>" is estimated at 2 tokens, so 3 fit in a 6 token budget
+    model = make_model(embeddings_server, batch_size=100, max_batch_tokens=6)
+    texts = make_texts(7)
+
+    embeddings = model.get_text_embedding_batch(texts)
+
+    assert embeddings == [fake_embedding(text) for text in texts]
+    assert request_sizes(embeddings_server) == [3, 3, 1]
+
+
+def test_async_batches_come_back_in_input_order(embeddings_server):
+    model = make_model(embeddings_server, batch_size=3)
+    texts = make_texts(20)
+
+    embeddings = asyncio.run(model.aget_text_embedding_batch(texts))
+
+    assert embeddings == [fake_embedding(text) for text in texts]
+    assert max(request_sizes(embeddings_server)) <= 3
+
+
+def test_embed_in_batches_pairs_items_with_their_embeddings(embeddings_server):
+    model = make_model(embeddings_server, batch_size=4)
+    items = [{"text": text} for text in make_texts(11)]
+
+    batches = list(model.embed_in_batches(items, lambda item: item["text"]))
+
+    assert [len(batch) for batch, _ in batches] == [4, 4, 3]
+    for batch, embeddings in batches:
+        assert embeddings == [fake_embedding(item["text"]) for item in batch]
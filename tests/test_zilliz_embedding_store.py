@@ -0,0 +1,208 @@
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pytest
+from llama_index.core.embeddings import BaseEmbedding
+
+from src.retrieval import zilliz_embedding_store
+from src.retrieval.embedding_core import document_id
+from src.retrieval.zilliz_embedding_store import MAX_TEXT_BYTES, ZillizEmbeddingStore
+
+
+class Crash(BaseException):
+    """Stands in for the process dying; not caught like an ordinary error."""
+
+
+class FakeCollection:
+    """In-memory stand-in for a Milvus collection that, like Milvus, allows duplicate ids."""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.texts: Dict[str, str] = {}
+        self.indexed = False
+        # called with the ids of each insert, after they are stored
+        self.after_insert = None
+        self.bad_text: Optional[str] = None
+
+    def create_index(self, field_name, index_params):
+        self.indexed = True
+
+    def has_index(self):
+        return self.indexed
+
+    def load(self):
+        assert self.indexed, "a collection without an index can't be loaded"
+
+    def insert(self, columns):
+        ids, _, texts, _ = columns
+        if self.bad_text in texts:
+            raise ValueError("rejected row")
+        self.ids.extend(ids)
+        self.texts.update(zip(ids, texts))
+        if self.after_insert is not None:
+            self.after_insert(ids)
+
+    def upsert(self, row):
+        if row["text"] == self.bad_text:
+            raise ValueError("rejected row")
+        if row["id"] not in self.texts:
+            self.ids.append(row["id"])
+        self.texts[row["id"]] = row["text"]
+
+    def query(self, expr, output_fields, consistency_level):
+        ids = json.loads(expr[len("id in ") :])
+        return [{"id": row_id} for row_id in ids if row_id in self.texts]
+
+    def flush(self):
+        pass
+
+
+class FakeMilvus:
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = {}
+        # given to collections as they are created
+        self.after_insert = None
+        self.bad_text: Optional[str] = None
+
+    def connect(self, **kwargs):
+        pass
+
+    def has_collection(self, name):
+        return name in self.collections
+
+    def Collection(self, name, schema=None):
+        if name not in self.collections:
+            collection = FakeCollection()
+            collection.after_insert = self.after_insert
+            collection.bad_text = self.bad_text
+            self.collections[name] = collection
+        return self.collections[name]
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Embeds texts by length, and can be told to crash after some batches."""
+
+    n_calls: int = 0
+    crash_after: Optional[int] = None
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if self.crash_after is not None and self.n_calls >= self.crash_after:
+            raise Crash()
+        self.n_calls += 1
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed(texts)
+
+    def _get_text_embedding(self, text):
+        return self._embed([text])[0]
+
+    def _get_query_embedding(self, query):
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query):
+        return self._embed([query])[0]
+
+
+@pytest.fixture
+def milvus(monkeypatch):
+    fake = FakeMilvus()
+    monkeypatch.setattr(zilliz_embedding_store.connections, "connect", fake.connect)
+    monkeypatch.setattr(
+        zilliz_embedding_store.utility, "has_collection", fake.has_collection
+    )
+    monkeypatch.setattr(zilliz_embedding_store, "Collection", fake.Collection)
+    return fake
+
+
+def write_documents(tmp_path: Path, texts: List[str]) -> Path:
+    document_path = tmp_path / "documents.txt"
+    document_path.write_text("\n-----\n".join(texts))
+    return document_path
+
+
+def make_store(tmp_path: Path, document_path: Path, embed_model: BaseEmbedding):
+    return ZillizEmbeddingStore(
+        embedding_config_path=None,
+        uri="http://fake",
+        token="fake",
+        collection_name="test",
+        dimension=2,
+        document_path=document_path,
+        flush_size=5,
+        checkpoint_path=tmp_path / "checkpoint.json",
+        embed_model=(
+            FakeEmbedding(model_name="fake", embed_batch_size=2)
+            if embed_model is None
+            else embed_model
+        ),
+    )
+
+
+def expected_ids(texts: List[str]) -> Counter:
+    return Counter({document_id(text, {}): 1 for text in texts if text})
+
+
+# 23 documents, some repeated, so windows of 5 contain duplicates of each
+# other and of earlier windows
+TEXTS = [f"document {i % 17}" for i in range(23)]
+
+
+def test_resume_after_crash_while_embedding(tmp_path, milvus):
+    document_path = write_documents(tmp_path, TEXTS)
+    crashing = FakeEmbedding(model_name="fake", embed_batch_size=2, crash_after=4)
+    with pytest.raises(Crash):
+        make_store(tmp_path, document_path, crashing)
+    collection = milvus.collections["test"]
+    assert 0 < len(collection.ids) < len(expected_ids(TEXTS))
+
+    store = make_store(tmp_path, document_path, None)
+
+    assert Counter(store.collection.ids) == expected_ids(TEXTS)
+    assert json.loads((tmp_path / "checkpoint.json").read_text())["complete"]
+
+
+def test_resume_after_crash_between_insert_and_checkpoint(tmp_path, milvus):
+    document_path = write_documents(tmp_path, TEXTS)
+    n_inserts = 0
+
+    def crash_on_third_insert(ids):
+        nonlocal n_inserts
+        n_inserts += 1
+        if n_inserts == 3:
+            raise Crash()
+
+    milvus.after_insert = crash_on_third_insert
+    with pytest.raises(Crash):
+        make_store(tmp_path, document_path, None)
+    collection = milvus.collections["test"]
+    collection.after_insert = None
+
+    make_store(tmp_path, document_path, None)
+
+    # the third window was inserted but not checkpointed, so it is read again
+    assert Counter(collection.ids) == expected_ids(TEXTS)
+
+
+def test_resume_creates_missing_index(tmp_path, milvus):
+    document_path = write_documents(tmp_path, TEXTS)
+    make_store(tmp_path, document_path, None)
+    collection = milvus.collections["test"]
+    collection.indexed = False
+
+    make_store(tmp_path, document_path, None)
+
+    assert collection.indexed
+
+
+def test_bad_rows_are_skipped(tmp_path, milvus):
+    too_long = "x" * (MAX_TEXT_BYTES + 1)
+    texts = TEXTS[:7] + [too_long, "rejected"] + TEXTS[7:]
+    document_path = write_documents(tmp_path, texts)
+    milvus.bad_text = "rejected"
+
+    store = make_store(tmp_path, document_path, None)
+
+    assert Counter(store.collection.ids) == expected_ids(TEXTS)